@@ -0,0 +1,124 @@
+# Times parsing, tree building, JSON export and writing on synthetic worlds.
+#
+#   python benchmarks/run.py --scale medium --bit32 --min-client 510 --repeat 3 --memory
+#
+# Every configuration is generated with dmb.synthetic, written to a temporary file and then put through each phase.
+# Times are the best of --repeat runs; with --memory every phase is run once more under tracemalloc to record the
+# peak of memory allocated by it.
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, ObjectTree, string_mode_strings
+from dmb.dmbreader import lazy_sections
+from dmb.synthetic import presets, synthetic_dmb
+from dmb import columnar
+
+
+def phases(path, scratch):
+    state = {}
+
+    def generate():
+        state["source"] = synthetic_dmb(**state["params"])
+
+    def write():
+        state["source"].write(path)
+
+    def scan():
+        state["lazy"] = Dmb(path, sections=[])
+
+    def section(name):
+        return lambda: getattr(state["lazy"], name)
+
+    def parse():
+        state["dmb"] = Dmb(path)
+
+    def parse_columnar():
+        Dmb(path, columnar=True)
+
+    def parse_strings():
+        state["decoded"] = Dmb(path, string_mode=string_mode_strings)
+
+    def tree():
+        state["tree"] = ObjectTree(tree={}, dmb=state["decoded"])
+
+    def export():
+        state["tree"].json()
+
+    def rewrite():
+        state["dmb"].write(scratch)
+
+    ret = [("generate", generate), ("write", write), ("scan", scan)]
+    ret += [("load " + name, section(name)) for name in lazy_sections]
+    ret += [("parse", parse)]
+    if columnar.np is not None:
+        ret += [("parse columnar", parse_columnar)]
+    ret += [("parse strings", parse_strings), ("tree", tree), ("json", export), ("rewrite", rewrite)]
+    return state, ret
+
+
+def run(params, repeat, memory):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.dmb")
+        scratch = os.path.join(directory, "rewrite.dmb")
+        results = {}
+        for i in range(repeat):
+            state, steps = phases(path, scratch)
+            state["params"] = params
+            for name, step in steps:
+                start = time.perf_counter()
+                step()
+                elapsed = time.perf_counter() - start
+                results[name] = min(results.get(name, elapsed), elapsed)
+        peaks = {}
+        if memory:
+            state, steps = phases(path, scratch)
+            state["params"] = params
+            tracemalloc.start()
+            for name, step in steps:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                step()
+                peaks[name] = tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+        size = os.path.getsize(path)
+    return size, [(name, results[name], peaks.get(name)) for name in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dmb parsing on synthetic worlds.")
+    parser.add_argument("--scale", choices=sorted(presets), default="small")
+    parser.add_argument("--bit32", action="store_true")
+    parser.add_argument("--min-client", type=int, action="append", help="may be given more than once (default: 499, 507, 508, 510)")
+    parser.add_argument("--run-length", type=int, default=8, help="average length of runs of identical tiles")
+    parser.add_argument("--instance-density", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="also record peak memory per phase")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file as well")
+    args = parser.parse_args()
+
+    report = []
+    for min_client in args.min_client or [499, 507, 508, 510]:
+        params = dict(presets[args.scale], bit32=args.bit32, min_client=min_client, run_length=args.run_length, instance_density=args.instance_density, seed=args.seed)
+        size, results = run(params, args.repeat, args.memory)
+        print("{0}, {1}-bit, min_client {2}: {3:.1f} MiB".format(args.scale, 32 if args.bit32 else 16, min_client, size / 1048576))
+        for name, seconds, peak in results:
+            if peak is None:
+                print("  {0:<20} {1:9.4f} s".format(name, seconds))
+            else:
+                print("  {0:<20} {1:9.4f} s {2:10.1f} MiB".format(name, seconds, peak / 1048576))
+        report.append({"params": params, "size": size, "phases": [{"name": name, "seconds": seconds, "peak": peak} for name, seconds, peak in results]})
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
-from . import constants, crypt, dmb, dmbreader, dmbwriter, json, tree, value
+from . import cache, columnar, compare, constants, crypt, dmb, dmbreader, dmbwriter, json, lazystrings, stats, synthetic, tree, value
 from .constants import *
 from .dmbwriter import *
 from .dmb import *
 from .value import *
 from .tree import *
 from .dmbreader import *
+from .compare import *
 
-__all__ = ["constants", "dmb", "dmbreader", "dmbwriter", "tree", "value"]
+__all__ = ["cache", "columnar", "compare", "constants", "dmb", "dmbreader", "dmbwriter", "lazystrings", "stats", "synthetic", "tree", "value"]
@@ -0,0 +1,402 @@
+from .dmb import Mob, Proc, WorldData, Var, Instance, Resource, Type, Tile
+from .lazystrings import LazyStringTable
+from .value import compiled_value, decode_values, new_value_cache
+from . import columnar
+import array
+import hashlib
+import json
+import os
+import struct
+import sys
+
+
+default_cache_size = 1 << 30
+cache_format = 3  # bump whenever the stored tables change, so older entries are never loaded
+cache_magic = b"pydmb cache\n"
+_header_struct = struct.Struct("<12sII")  # magic, format, length of the JSON header
+
+record_classes = dict((cls.__name__, cls) for cls in (Mob, Proc, WorldData, Var, Instance, Resource, Type))
+table_classes = ("ColumnarTable", "VarTable", "InstanceTable", "ResourceTable")
+
+
+class _Unset:
+    pass
+
+
+_unset = _Unset()
+
+
+class CacheFormatError(ValueError):
+    pass
+
+
+# Parsed dmb tables stored in one directory, keyed by a digest of the file contents and the options that change what
+# gets stored. A small pointer file keyed by path, size and mtime remembers the content digest so unchanged files are
+# not hashed again. Entries are evicted least recently used first once the directory grows past max_size.
+class ParseCache:
+    def __init__(self, directory, max_size=default_cache_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def digest(self, dmbname):
+        st = os.stat(dmbname)
+        stat_key = "{0}\0{1}\0{2}".format(os.path.abspath(dmbname), st.st_size, st.st_mtime_ns)
+        pointer = self._path(hashlib.sha1(stat_key.encode('utf-8')).hexdigest() + ".key")
+        try:
+            with open(pointer, 'r') as f:
+                return f.read()
+        except OSError:
+            pass
+        h = hashlib.sha1()
+        with open(dmbname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._write(pointer, digest.encode('ascii'))
+        return digest
+
+    def key(self, dmbname, options):
+        return "{0}-{1}".format(self.digest(dmbname), hashlib.sha1(repr((cache_format, sys.byteorder, options)).encode('utf-8')).hexdigest()[:16])
+
+    # The stored entry, or None if there is none or it cannot be read; a broken entry is removed.
+    def load(self, key):
+        path = self._path(key + ".dmbcache")
+        try:
+            with open(path, 'rb') as f:
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                if f.readinto(data) != len(data):
+                    raise EOFError()
+            entry = CacheEntry(data)
+        except Exception:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def store(self, key, data):
+        self._write(self._path(key + ".dmbcache"), data)
+        self.evict()
+
+    def _write(self, path, data):
+        temp = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        except BaseException:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+
+    # Entries and pointer files both count against max_size. Entries are removed least recently used first; a pointer
+    # is removed once no entry for its digest is left, which also clears the pointers of older versions of a file.
+    def evict(self):
+        entries = []
+        pointers = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((".dmbcache", ".key")):
+                continue
+            try:
+                st = os.stat(self._path(name))
+            except OSError:
+                continue
+            (entries if name.endswith(".dmbcache") else pointers).append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for mtime, size, name in entries) + sum(size for mtime, size, name in pointers)
+        kept = []
+        for mtime, size, name in entries:
+            if total > self.max_size:
+                try:
+                    os.remove(self._path(name))
+                    total -= size
+                    continue
+                except OSError:
+                    pass
+            kept.append(name)
+        digests = set(name.split("-", 1)[0] for name in kept)
+        for mtime, size, name in pointers:
+            try:
+                with open(self._path(name), 'r') as f:
+                    if f.read() in digests:
+                        continue
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+
+# Serializes the loaded tables of dmb: a JSON header describing every table, followed by the raw columns. Records are
+# stored one column per slot, byte strings as one blob plus offsets, compiled values as their (typeid, value) pairs and
+# NumPy tables as their raw arrays. Raises CacheFormatError for anything else.
+def encode_tables(dmb, names):
+    out = _ColumnWriter()
+    tables = {"world": _encode_records(out, [dmb.world])}
+    for name in names:
+        tables[name] = _encode_table(out, name, getattr(dmb, name))
+    if "mappops" in dmb.sections:
+        section = dmb.sections["mappops"]
+        pops = list(dmb.layouts.mappop.iter_unpack(dmb.buffer[section.offset:section.offset + section.count * dmb.layouts.mappop.size]))
+        tables["mappops"] = {"move": _encode_column(out, [pop[0] for pop in pops]), "instance": _encode_column(out, [pop[1] for pop in pops])}
+    header = {
+        "byteorder": sys.byteorder,
+        "flags": dmb.flags,
+        "bit32": dmb.bit32,
+        "strcrc": dmb.strcrc,
+        "sections": [[s.name, s.offset, s.count, s.end] for s in dmb.sections.values()],
+        "tables": tables,
+        "size": out.size,
+    }
+    header = json.dumps(header, separators=(",", ":")).encode('utf-8')
+    header += b" " * (-(_header_struct.size + len(header)) % 8)
+    return b"".join([_header_struct.pack(cache_magic, cache_format, len(header)), header] + out.chunks)
+
+
+def _encode_table(out, name, table):
+    if isinstance(table, LazyStringTable):
+        buffer, offsets, lengths, keys = table.columns()
+        return {"kind": "lazystrings", "buffer": out.add(buffer), "offsets": _encode_column(out, list(offsets)),
+                "lengths": _encode_column(out, list(lengths)), "keys": _encode_column(out, list(keys))}
+    if isinstance(table, columnar.TileGrid):
+        return {"kind": "tilegrid", "area": _encode_array(out, table.area), "turf": _encode_array(out, table.turf),
+                "unknown": _encode_array(out, table.unknown)}
+    if type(table).__name__ in table_classes and isinstance(table, columnar.ColumnarTable):
+        return dict(_encode_array(out, table.array), kind="array", table=type(table).__name__)
+    if name == "tiles":
+        flat = [tile for level in table for row in level for tile in row]
+        return {"kind": "tiles", "area": _encode_column(out, [t.area for t in flat]), "turf": _encode_column(out, [t.turf for t in flat]),
+                "unknown": _encode_column(out, [t.unknown for t in flat])}
+    table = list(table)
+    if table and all(type(record).__name__ in record_classes for record in table) and len(set(map(type, table))) == 1:
+        return _encode_records(out, table)
+    return {"kind": "list", "count": len(table), "values": _encode_column(out, table)}
+
+
+def _encode_records(out, records):
+    cls = type(records[0])
+    columns = {}
+    for slot in _slots(cls):
+        columns[slot] = _encode_column(out, [getattr(record, slot, _unset) for record in records])
+    return {"kind": "records", "class": cls.__name__, "count": len(records), "columns": columns}
+
+
+def _encode_array(out, values):
+    values = columnar.np.ascontiguousarray(values)
+    dtype = values.dtype.descr if values.dtype.names is not None else values.dtype.str
+    return {"dtype": dtype, "shape": list(values.shape), "data": out.add(values.tobytes())}
+
+
+# present holds 0 for an unset slot, 1 for a value and 2 for None, and is left out when every row has a value. Columns
+# holding values of more than one kind (a slot that is 0 until its bytes are read, say) store a kind tag per value and
+# one column per kind.
+def _encode_column(out, values):
+    types = set(map(type, values))
+    ret = {}
+    if _Unset in types or type(None) in types:
+        ret["present"] = out.add(bytearray(0 if value is _unset else (2 if value is None else 1) for value in values))
+        dense = [value for value in values if value is not None and value is not _unset]
+        types.discard(_Unset)
+        types.discard(type(None))
+    else:
+        dense = values
+    kind_of = dict((t, "value" if issubclass(t, compiled_value) else t.__name__) for t in types)
+    kinds = sorted(set(kind_of.values()))
+    if not dense:
+        ret["kind"] = "none"
+    elif len(kinds) == 1:
+        ret.update(_encode_dense(out, kinds[0], dense))
+    else:
+        tag_of = dict((t, kinds.index(kind)) for t, kind in kind_of.items())
+        ret["kind"] = "mixed"
+        ret["tags"] = out.add(bytearray(tag_of[type(value)] for value in dense))
+        ret["parts"] = [_encode_dense(out, kind, [value for value in dense if kind_of[type(value)] == kind]) for kind in kinds]
+    return ret
+
+
+def _encode_dense(out, kind, dense):
+    ret = {"kind": kind}
+    if kind in ("int", "bool"):
+        ret["code"], ret["data"] = _add_ints(out, [int(value) for value in dense])
+    elif kind == "float":
+        ret["data"] = out.add(array.array('d', dense).tobytes())
+    elif kind == "value":
+        ret["typeid"] = _encode_column(out, [value._typeid for value in dense])
+        ret["value"] = _encode_column(out, [value._value for value in dense])
+    elif kind in ("bytes", "bytearray", "str"):
+        if kind == "str":
+            try:
+                dense = [value.encode('iso-8859-1') for value in dense]
+                ret["encoding"] = "iso-8859-1"
+            except UnicodeEncodeError:
+                dense = [value.encode('utf-8') for value in dense]
+                ret["encoding"] = "utf-8"
+        offsets = [0]
+        for value in dense:
+            offsets.append(offsets[-1] + len(value))
+        ret["blob"] = out.add(b"".join(dense))
+        ret["code"], ret["offsets"] = _add_ints(out, offsets)
+    else:
+        raise CacheFormatError("Cannot store a column of {0}.".format(kind))
+    return ret
+
+
+def _add_ints(out, values):
+    low, high = min(values, default=0), max(values, default=0)
+    for code in ("BHIQ" if low >= 0 else "bhiq"):
+        bits = array.array(code).itemsize * 8
+        if (low >= 0 and high < 1 << bits) or (low >= -(1 << (bits - 1)) and high < 1 << (bits - 1)):
+            return code, out.add(array.array(code, values).tobytes())
+    raise CacheFormatError("Integer column out of range.")
+
+
+def _slots(cls):
+    ret = []
+    for klass in reversed(cls.__mro__):
+        for slot in getattr(klass, "__slots__", ()):
+            if slot not in ret:
+                ret.append(slot)
+    return ret
+
+
+class _ColumnWriter:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    # Appends data padded to 8 bytes and returns its [offset, length].
+    def add(self, data):
+        ret = [self.size, len(data)]
+        self.chunks.append(bytes(data))
+        padding = -len(data) % 8
+        if padding:
+            self.chunks.append(b"\0" * padding)
+        self.size += len(data) + padding
+        return ret
+
+
+# A stored entry read back. The header is checked when the entry is opened; tables are rebuilt from their columns only
+# when restore is called for them. Values decoded for vars and instances share one cache, like a parse does.
+class CacheEntry:
+    def __init__(self, data):
+        if len(data) < _header_struct.size:
+            raise CacheFormatError("Truncated cache entry.")
+        magic, version, length = _header_struct.unpack_from(data)
+        if magic != cache_magic or version != cache_format:
+            raise CacheFormatError("Not a cache entry of this version.")
+        self.header = json.loads(bytes(data[_header_struct.size:_header_struct.size + length]).decode('utf-8'))
+        self.data = memoryview(data)[_header_struct.size + length:]
+        if self.header["byteorder"] != sys.byteorder or self.header["size"] != len(self.data):
+            raise CacheFormatError("Cache entry does not match this machine or is truncated.")
+        self.values = new_value_cache()
+
+    @property
+    def tables(self):
+        return self.header["tables"]
+
+    def __contains__(self, name):
+        return name in self.header["tables"]
+
+    def _bytes(self, ref):
+        return self.data[ref[0]:ref[0] + ref[1]]
+
+    def _ints(self, code, ref):
+        ret = array.array(code)
+        ret.frombytes(self._bytes(ref))
+        return ret
+
+    def _array(self, desc):
+        np = columnar.np
+        if np is None:
+            raise ImportError("Columnar mode requires numpy.")
+        dtype = np.dtype([tuple(field) for field in desc["dtype"]] if isinstance(desc["dtype"], list) else desc["dtype"])
+        return np.frombuffer(self._bytes(desc["data"]), dtype=dtype).reshape(desc["shape"])
+
+    # Row values of a column, with _unset for unset slots.
+    def _column(self, desc, count):
+        kind = desc["kind"]
+        if kind == "none":
+            dense = []
+        elif kind == "mixed":
+            parts = [iter(self._dense(part)) for part in desc["parts"]]
+            dense = [next(parts[tag]) for tag in self._bytes(desc["tags"])]
+        else:
+            dense = self._dense(desc)
+        if "present" not in desc:
+            return dense
+        values = iter(dense)
+        return [next(values) if flag == 1 else (None if flag == 2 else _unset) for flag in self._bytes(desc["present"])]
+
+    def _dense(self, desc):
+        kind = desc["kind"]
+        if kind == "int":
+            return self._ints(desc["code"], desc["data"]).tolist()
+        elif kind == "bool":
+            return [bool(value) for value in self._ints(desc["code"], desc["data"])]
+        elif kind == "float":
+            return self._ints('d', desc["data"]).tolist()
+        elif kind == "value":
+            return decode_values(zip(self._column(desc["typeid"], None), self._column(desc["value"], None)), self.values)
+        elif kind in ("bytes", "bytearray", "str"):
+            blob = bytes(self._bytes(desc["blob"]))
+            offsets = self._ints(desc["code"], desc["offsets"])
+            if kind == "str" and desc["encoding"] == "iso-8859-1":
+                blob = blob.decode('iso-8859-1')
+            ret = [blob[start:end] for start, end in zip(offsets, offsets[1:])]
+            if kind == "str" and desc["encoding"] != "iso-8859-1":
+                ret = [value.decode('utf-8') for value in ret]
+            elif kind == "bytearray":
+                ret = [bytearray(value) for value in ret]
+            return ret
+        raise CacheFormatError("Unknown column kind: {0}".format(kind))
+
+    def _records(self, desc):
+        cls = record_classes[desc["class"]]
+        records = [cls.__new__(cls) for i in range(desc["count"])]
+        for slot, column in desc["columns"].items():
+            set_slot = getattr(cls, slot).__set__
+            values = self._column(column, desc["count"])
+            if "present" in column:
+                for record, value in zip(records, values):
+                    if value is not _unset:
+                        set_slot(record, value)
+            else:
+                list(map(set_slot, records, values))
+        return records
+
+    def world(self):
+        return self._records(self.tables["world"])[0]
+
+    # Moves and instance ids of the map population records.
+    def mappops(self):
+        desc = self.tables["mappops"]
+        return self._column(desc["move"], None), self._column(desc["instance"], None)
+
+    def restore(self, dmb, name):
+        desc = self.tables[name]
+        kind = desc["kind"]
+        if kind == "records":
+            return self._records(desc)
+        elif kind == "list":
+            return self._column(desc["values"], desc["count"])
+        elif kind == "lazystrings":
+            return LazyStringTable.from_columns(self._bytes(desc["buffer"]), self._column(desc["offsets"], None), self._column(desc["lengths"], None),
+                                                self._column(desc["keys"], None), dmb.string_cache_size)
+        elif kind == "array":
+            return getattr(columnar, desc["table"])(self._array(desc), self.values)
+        elif kind == "tilegrid":
+            return columnar.TileGrid(self._array(desc["area"]), self._array(desc["turf"]), self._array(desc["unknown"]))
+        elif kind == "tiles":
+            tiles = list(map(Tile, self._column(desc["area"], None), self._column(desc["turf"], None), self._column(desc["unknown"], None)))
+            map_x, map_y, map_z = dmb.world.map_x, dmb.world.map_y, dmb.world.map_z
+            return [[tiles[(z * map_y + y) * map_x:(z * map_y + y + 1) * map_x] for y in range(map_y)] for z in range(map_z)]
+        raise CacheFormatError("Unknown table kind: {0}".format(kind))
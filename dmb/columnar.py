@@ -0,0 +1,224 @@
+from .dmb import Var, Instance, Resource, Tile
+from .value import intern_value, new_value_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def arch_dtype(bit32):
+    return np.dtype("<u4" if bit32 else "<u2")
+
+
+def var_dtype(bit32):
+    return np.dtype([("typeid", "u1"), ("value", "<u4"), ("name", arch_dtype(bit32))])
+
+
+def instance_dtype(bit32):
+    return np.dtype([("typeid", "u1"), ("value", "<u4"), ("initializer", arch_dtype(bit32))])
+
+
+def mappop_dtype(bit32):
+    return np.dtype([("move", "<u2"), ("instance", arch_dtype(bit32))])
+
+
+def tile_run_dtype(bit32):
+    return np.dtype([("area", arch_dtype(bit32)), ("turf", arch_dtype(bit32)), ("unknown", arch_dtype(bit32)), ("count", "u1")])
+
+
+def resource_dtype():
+    return np.dtype([("hash", "<u4"), ("typeid", "u1")])
+
+
+number_typeid = 42
+
+
+# Row ids of the number-typed rows of a var or instance array, and their values reinterpreted as float32.
+def number_columns(array):
+    ids = np.flatnonzero(array["typeid"] == number_typeid)
+    return ids, array["value"][ids].view("<f4")
+
+
+# A fixed-width section held as one NumPy array. Indexing and iteration hand out the usual record objects, built from
+# the row on demand; the array itself is available as .array for column-wise work. values is the cache row values are
+# decoded through, shared with the other tables of the same Dmb.
+class ColumnarTable:
+    def __init__(self, array, values=None):
+        self.array = array
+        self.values = values if values is not None else new_value_cache()
+
+    def _row(self, fields):
+        return fields
+
+    def column(self, name):
+        return self.array[name]
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(self.array[index], self.values)
+        return self._row(self.array[index].item())
+
+    def __iter__(self):
+        row = self._row
+        for fields in self.array.tolist():
+            yield row(fields)
+
+    def __repr__(self):
+        return "{0}({1} rows)".format(type(self).__name__, len(self.array))
+
+
+class VarTable(ColumnarTable):
+    def _row(self, fields):
+        ret = Var()
+        typeid, typeval, ret.name = fields
+        ret.value = intern_value(typeid, typeval, self.values)
+        return ret
+
+
+class InstanceTable(ColumnarTable):
+    def _row(self, fields):
+        ret = Instance()
+        typeid, typeval, ret.initializer = fields
+        ret.value = intern_value(typeid, typeval, self.values)
+        return ret
+
+
+class ResourceTable(ColumnarTable):
+    def _row(self, fields):
+        return Resource(fields[1], fields[0])
+
+
+# Nested z/y/x access to a TileGrid, so code written against the nested tile lists keeps working.
+class TileGridSlice:
+    def __init__(self, grid, prefix):
+        self.grid = grid
+        self.prefix = prefix
+
+    def __len__(self):
+        return self.grid.area.shape[len(self.prefix)]
+
+    def __getitem__(self, index):
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("Tile index out of map range.")
+        prefix = self.prefix + (index,)
+        if len(prefix) == 3:
+            return self.grid.tile(prefix[2], prefix[1], prefix[0])
+        return TileGridSlice(self.grid, prefix)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+# The map as three (z, y, x) arrays of area, turf and unknown ids. Tiles are built as views on access; changing a view
+# does not change the grid.
+#
+# Instances placed on the map are kept in compressed sparse row form: the ids of the instances on the tile with linear
+# index i (see linear_index) are instance_ids[instance_offsets[i]:instance_offsets[i + 1]].
+class TileGrid(TileGridSlice):
+    def __init__(self, area, turf, unknown):
+        super().__init__(self, ())
+        self.area = area
+        self.turf = turf
+        self.unknown = unknown
+        self.instance_offsets = np.zeros(area.size + 1, dtype=np.int64)
+        self.instance_ids = np.zeros(0, dtype=np.int64)
+        self.instance_table = None
+
+    @classmethod
+    def from_runs(cls, runs, shape):
+        counts = runs["count"]
+        total = shape[0] * shape[1] * shape[2]
+        area, turf, unknown = (np.repeat(runs[field], counts)[:total].reshape(shape) for field in ("area", "turf", "unknown"))
+        return cls(area, turf, unknown)
+
+    def linear_index(self, x, y, z):
+        shape = self.area.shape
+        return (z * shape[1] + y) * shape[2] + x
+
+    # linear holds the (nondecreasing) linear tile index of every entry of instance_ids.
+    def index_instances(self, linear, instance_ids, instance_table):
+        tiles = self.area.size
+        if len(linear) and linear[-1] >= tiles:
+            raise IndexError("Map population out of map range.")
+        self.instance_offsets = np.zeros(tiles + 1, dtype=np.int64)
+        np.cumsum(np.bincount(linear, minlength=tiles), out=self.instance_offsets[1:])
+        self.instance_ids = instance_ids
+        self.instance_table = instance_table
+
+    def tile_instance_ids(self, x, y, z):
+        index = self.linear_index(x, y, z)
+        return self.instance_ids[self.instance_offsets[index]:self.instance_offsets[index + 1]]
+
+    def level_instance_ids(self, z):
+        plane = self.area.shape[1] * self.area.shape[2]
+        return self.instance_ids[self.instance_offsets[z * plane]:self.instance_offsets[(z + 1) * plane]]
+
+    def region(self, z, x0, y0, x1, y1):
+        return TileRegion(self, z, x0, y0, x1, y1)
+
+    # coords is an (n, 3) array of x, y, z; returns the area, turf and unknown ids of those tiles.
+    def tiles_at(self, coords):
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+        if len(coords) and ((coords < 0).any() or (coords >= self.area.shape[::-1]).any()):
+            raise IndexError("Coordinates out of map range.")
+        index = (coords[:, 2], coords[:, 1], coords[:, 0])
+        return self.area[index], self.turf[index], self.unknown[index]
+
+    def tile(self, x, y, z):
+        ret = Tile(int(self.area[z, y, x]), int(self.turf[z, y, x]), int(self.unknown[z, y, x]))
+        ids = self.tile_instance_ids(x, y, z)
+        if len(ids):
+            ret.instances = [self.instance_table[instanceid] for instanceid in ids.tolist()]
+        return ret
+
+    def __repr__(self):
+        return "TileGrid({0})".format(self.area.shape)
+
+
+# The tiles x0 <= x < x1, y0 <= y < y1 of z-level z. area, turf and unknown are (y, x) views of the grid arrays.
+class TileRegion:
+    def __init__(self, grid, z, x0, y0, x1, y1):
+        z_range, y_range, x_range = grid.area.shape
+        if z < 0 or z >= z_range:
+            raise IndexError("Z out of map range.")
+        if y0 < 0 or y0 > y1 or y1 > y_range:
+            raise IndexError("Y out of map range.")
+        if x0 < 0 or x0 > x1 or x1 > x_range:
+            raise IndexError("X out of map range.")
+        self.grid = grid
+        self.z = z
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.area = grid.area[z, y0:y1, x0:x1]
+        self.turf = grid.turf[z, y0:y1, x0:x1]
+        self.unknown = grid.unknown[z, y0:y1, x0:x1]
+        # Offsets of the first tile of every row in the region and of the tile after its last one.
+        rows = grid.linear_index(x0, np.arange(y0, y1, dtype=np.int64), z)
+        self._row_starts = grid.instance_offsets[rows]
+        self._row_ends = grid.instance_offsets[rows + (x1 - x0)]
+
+    # Number of instances on every tile, as a (y, x) array.
+    def instance_counts(self):
+        x = np.arange(self.x0, self.x1 + 1, dtype=np.int64)
+        rows = self.grid.linear_index(x[None, :], np.arange(self.y0, self.y1, dtype=np.int64)[:, None], self.z)
+        return np.diff(self.grid.instance_offsets[rows], axis=1)
+
+    # Slice of the grid's instance ids for one row of the region, relative to y0.
+    def row_instance_ids(self, row):
+        return self.grid.instance_ids[self._row_starts[row]:self._row_ends[row]]
+
+    # Ids of all instances in the region, row by row.
+    def instance_ids(self):
+        if len(self._row_starts) == 0:
+            return self.grid.instance_ids[:0]
+        return np.concatenate([self.row_instance_ids(row) for row in range(len(self._row_starts))])
+
+    def __repr__(self):
+        return "TileRegion(z={0}, x={1}:{2}, y={3}:{4})".format(self.z, self.x0, self.x1, self.y0, self.y1)
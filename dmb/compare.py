@@ -0,0 +1,222 @@
+from .dmb import WorldData
+from .dmbreader import Dmb, section_order
+from .value import value_string, value_type
+import hashlib
+
+__all__ = ["DmbDiff", "PartDiff", "diff", "section_hashes"]
+
+
+# The sections each part of a diff is built from. A part is only compared record by record when at least one of its
+# sections differs between the two files; "header" is everything before the tiles.
+report_sections = {
+    "strings": ["strings"],
+    "types": ["types", "strings", "data", "variables", "procs", "resources"],
+    "procs": ["procs", "strings", "data", "variables", "argprocs"],
+    "world": ["header", "world", "strings", "types"],
+}
+
+world_string_fields = ["world_domain", "world_name", "hub_password", "world_status", "default_command_text", "default_command_prompt", "hub_path"]
+world_type_fields = ["default_mob", "default_turf", "default_area"]
+
+
+# Keys of added, removed and changed records. For the world part, changed maps each field to its (old, new) value.
+class PartDiff:
+    def __init__(self, added=None, removed=None, changed=None):
+        self.added = added if added is not None else []
+        self.removed = removed if removed is not None else []
+        self.changed = changed if changed is not None else []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return "PartDiff(+{0}, -{1}, ~{2})".format(len(self.added), len(self.removed), len(self.changed))
+
+    def __json__(self):
+        return {
+            "added": self.added,
+            "removed": self.removed,
+            "changed": self.changed,
+        }
+
+
+class DmbDiff:
+    def __init__(self):
+        self.unchanged_sections = []
+        self.strings = PartDiff()
+        self.types = PartDiff()
+        self.procs = PartDiff()
+        self.world = PartDiff(changed={})
+
+    def __bool__(self):
+        return bool(self.strings or self.types or self.procs or self.world)
+
+    def __repr__(self):
+        return "DmbDiff(strings={0}, types={1}, procs={2}, world={3})".format(self.strings, self.types, self.procs, self.world)
+
+    def __json__(self):
+        return {
+            "unchanged_sections": self.unchanged_sections,
+            "strings": self.strings,
+            "types": self.types,
+            "procs": self.procs,
+            "world": self.world,
+        }
+
+
+# Compares two dmbs, given as paths or Dmb objects. Types are matched by path and procs by path (and position among
+# procs sharing a path), so records that only moved to another id do not show up. Sections that are byte for byte
+# identical are never parsed; changed ones are compared through a digest of every record with its string, type and
+# variable references resolved. Proc code is compared as raw bytecode.
+def diff(a, b, **kwargs):
+    opened = []
+    try:
+        a = _open(a, opened, kwargs)
+        b = _open(b, opened, kwargs)
+        hashes_a = section_hashes(a)
+        hashes_b = section_hashes(b)
+        unchanged = set(name for name in hashes_a if hashes_a[name] == hashes_b.get(name))
+        ret = DmbDiff()
+        ret.unchanged_sections = [name for name in ["header"] + section_order if name in unchanged]
+        if not all(name in unchanged for name in report_sections["strings"]):
+            strings_a = set(bytes(_text_bytes(s)) for s in a.strings)
+            strings_b = set(bytes(_text_bytes(s)) for s in b.strings)
+            ret.strings = PartDiff(sorted(strings_b - strings_a), sorted(strings_a - strings_b))
+        if not all(name in unchanged for name in report_sections["types"]):
+            ret.types = _diff_digests(_type_digests(a), _type_digests(b))
+        if not all(name in unchanged for name in report_sections["procs"]):
+            ret.procs = _diff_digests(_proc_digests(a), _proc_digests(b))
+        if not all(name in unchanged for name in report_sections["world"]):
+            fields_a = _world_fields(a)
+            fields_b = _world_fields(b)
+            ret.world.changed = dict((k, (fields_a[k], fields_b[k])) for k in fields_a if fields_a[k] != fields_b[k])
+        return ret
+    finally:
+        for dmb in opened:
+            dmb.close()
+
+
+def _open(dmb, opened, kwargs):
+    if isinstance(dmb, Dmb):
+        return dmb
+    dmb = Dmb(dmb, sections=[], **kwargs)
+    opened.append(dmb)
+    return dmb
+
+
+# SHA-1 of the bytes of every section. String table bytes depend on where the table starts, so its offset is hashed
+# too. A Dmb without a buffer (closed, or restored from a parse cache) has no hashes and every part is compared.
+def section_hashes(dmb):
+    if dmb.buffer is None:
+        return {}
+    ret = {"header": hashlib.sha1(dmb.buffer[:dmb.sections["tiles"].offset]).digest()}
+    for name, section in dmb.sections.items():
+        h = hashlib.sha1(dmb.buffer[section.offset:section.end])
+        if name == "strings":
+            h.update(str(section.offset).encode('ascii'))
+        ret[name] = h.digest()
+    return ret
+
+
+def _diff_digests(digests_a, digests_b):
+    added = [key for key in digests_b if key not in digests_a]
+    removed = [key for key in digests_a if key not in digests_b]
+    changed = [key for key in digests_a if key in digests_b and digests_a[key] != digests_b[key]]
+    return PartDiff(added, removed, changed)
+
+
+def _digest(fields):
+    return hashlib.sha1(repr(fields).encode('utf-8')).digest()
+
+
+def _text_bytes(s):
+    if isinstance(s, str):
+        return s.encode('iso-8859-1')
+    return s
+
+
+def _text(dmb, stringid):
+    s = dmb._resolve_string(stringid)
+    if s is None or isinstance(s, str):
+        return s
+    return bytes(s).decode('iso-8859-1')
+
+
+def _type_path(dmb, typeid):
+    if typeid == 0xFFFF:
+        return None
+    return _text(dmb, dmb.types[typeid].path)
+
+
+def _data_ids(dmb, dataid):
+    data = dmb._resolve_data(dataid)
+    if data is None:
+        return ()
+    return dmb._unpack_arch(bytes(data))
+
+
+def _value_fields(dmb, value):
+    if isinstance(value, value_string):
+        return (value._typeid, _text(dmb, value.value))
+    if isinstance(value, value_type):
+        return (value._typeid, _type_path(dmb, value.value))
+    return (value._typeid, value._value)
+
+
+def _var_fields(dmb, varid):
+    var = dmb._resolve_var(varid)
+    return (_text(dmb, var.name), _value_fields(dmb, var.value))
+
+
+def _proc_paths(dmb, dataid):
+    return tuple(_text(dmb, dmb._resolve_proc(procid).path) for procid in _data_ids(dmb, dataid))
+
+
+# Keys records by path; a path seen again gets "#n" appended, n counting from 1.
+def _keyed(records, path):
+    seen = {}
+    for record in records:
+        key = path(record)
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        yield (key if n == 0 else "{0}#{1}".format(key, n)), record
+
+
+def _type_digests(dmb):
+    ret = {}
+    for key, t in _keyed(dmb.types, lambda t: _text(dmb, t.path)):
+        varids = _data_ids(dmb, t.variable_list)
+        variables = tuple((_var_fields(dmb, varids[i]), varids[i + 1]) for i in range(0, len(varids) - 1, 2))
+        icon = dmb._resolve_resource(t.icon)
+        ret[key] = _digest((
+            _type_path(dmb, t.parent), _text(dmb, t.name), _text(dmb, t.desc), icon and (icon.typeid, icon.hash),
+            _text(dmb, t.icon_state), t.dir, _text(dmb, t.text), _text(dmb, t.suffix), _text(dmb, t.maptext),
+            t.maptext_width, t.maptext_height, t.maptext_x, t.maptext_y, t.flags, t.layer, variables,
+            _data_ids(dmb, t.builtin_variable_list), _proc_paths(dmb, t.proc_list), _proc_paths(dmb, t.verb_list),
+        ))
+    return ret
+
+
+def _proc_digests(dmb):
+    ret = {}
+    for key, p in _keyed(dmb.procs, lambda p: _text(dmb, p.path)):
+        local_names = tuple(_text(dmb, dmb._resolve_var(varid).name) for varid in _data_ids(dmb, p.variable_list))
+        args = list(_data_ids(dmb, p.argument_list))
+        for i in range(2, len(args), 4):
+            args[i] = _text(dmb, dmb._resolve_var(args[i]).name)
+        code = dmb._resolve_data(p.data)
+        ret[key] = _digest((
+            _text(dmb, p.name), _text(dmb, p.desc), _text(dmb, p.category), p.range, p.access, p.flags, p.ext_flags,
+            p.invisibility, local_names, tuple(args), bytes(code) if code is not None else None,
+        ))
+    return ret
+
+
+def _world_fields(dmb):
+    ret = dict((name, getattr(dmb.world, name)) for name in WorldData.__slots__)
+    ret["flags"] = dmb.flags
+    for name in world_string_fields:
+        ret[name] = _text(dmb, ret[name])
+    for name in world_type_fields:
+        ret[name] = _type_path(dmb, ret[name])
+    return ret
@@ -1,23 +1,99 @@
 from . import constants
+import struct
 try:
     import numpy as np
+    has_numpy = True
 except:
     from . import np_fallback as np
+    has_numpy = False
 
 
-n_8 = np.uint8(8)
-n_24 = np.uint8(24)
-n_255 = np.uint8(255)
+byond32_table = [int(v) for v in constants.byond32_tab]
 
 
-def byond32(initial, data, null_terminate=False):
-    crc = initial
+def _next_table(table):
+    return [((v << 8) & 0xFFFFFFFF) ^ byond32_table[v >> 24] for v in table]
+
+
+# Slicing-by-4 tables: _byond32_tables[k][b] is the CRC contribution of byte b followed by k zero bytes.
+_byond32_tables = [byond32_table]
+for _ in range(3):
+    _byond32_tables.append(_next_table(_byond32_tables[-1]))
+_slice_threshold = 32
+
+
+def _byond32_update(crc, data):
+    tab = byond32_table
+    n = len(data)
+    words = n >> 2 if n >= _slice_threshold else 0
+    if words:
+        t0, t1, t2, t3 = _byond32_tables
+        for word in struct.unpack_from('>{0}I'.format(words), data):
+            crc ^= word
+            crc = t3[crc >> 24] ^ t2[(crc >> 16) & 0xFF] ^ t1[(crc >> 8) & 0xFF] ^ t0[crc & 0xFF]
+        data = data[words << 2:]
     for byte in data:
-        b = np.uint8(byte)
-        tab = constants.byond32_tab[(b ^ (crc >> n_24)) & n_255]
-        crc = (tab ^ (crc << n_8))
-    if null_terminate:
-        b = np.uint8(0)
-        tab = constants.byond32_tab[(b ^ (crc >> n_24)) & n_255]
-        crc = (tab ^ (crc << n_8))
+        crc = tab[(crc >> 24) ^ byte] ^ ((crc << 8) & 0xFFFFFFFF)
     return crc
+
+
+class Byond32:
+    def __init__(self, initial=0):
+        self.crc = int(initial) & 0xFFFFFFFF
+
+    def update(self, data, null_terminate=False):
+        self.crc = _byond32_update(self.crc, data)
+        if null_terminate:
+            self.crc = byond32_table[self.crc >> 24] ^ ((self.crc << 8) & 0xFFFFFFFF)
+        return self
+
+    def digest(self):
+        return self.crc
+
+
+def byond32(initial, data, null_terminate=False):
+    return Byond32(initial).update(data, null_terminate).digest()
+
+
+# String bytes are XORed with a key that starts at the file offset of the string and advances by 9 per byte. Only the
+# low byte matters and 9 is odd, so the key stream repeats every 256 bytes and the stream for any start key is a
+# rotation of the stream for key 0, starting at key * 57 (the inverse of 9 mod 256).
+_key_stream = bytes((9 * i) & 0xFF for i in range(256)) * 2
+_table_chunk = 1 << 22
+
+
+# Encrypts or decrypts (the operation is symmetric) one string starting at key.
+def crypt_string(data, key):
+    n = len(data)
+    start = (key * 57) & 0xFF
+    stream = _key_stream[start:start + 256]
+    if n > 256:
+        stream = stream * (n // 256 + 1)
+    return bytearray((int.from_bytes(data, 'little') ^ int.from_bytes(stream[:n], 'little')).to_bytes(n, 'little'))
+
+
+# Decrypts every (offset, length, key) span of buffer, building the key stream for a few megabytes of strings at once.
+def decrypt_strings(buffer, spans):
+    if not has_numpy:
+        return [crypt_string(buffer[offset:offset + length], key) for offset, length, key in spans]
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    ret = []
+    first = 0
+    size = 0
+    for i in range(len(spans)):
+        size += spans[i][1]
+        if size >= _table_chunk or i == len(spans) - 1:
+            ret.extend(_decrypt_chunk(data, spans[first:i + 1]))
+            first = i + 1
+            size = 0
+    return ret
+
+
+def _decrypt_chunk(data, spans):
+    offsets, lengths, keys = (np.array(column, dtype=np.int64) for column in zip(*spans))
+    starts = np.cumsum(lengths) - lengths
+    position = np.arange(int(lengths.sum()), dtype=np.int64)
+    index = np.repeat(offsets - starts, lengths) + position
+    stream = np.repeat(((keys - 9 * starts) & 0xFF).astype(np.uint8), lengths) + position.astype(np.uint8) * np.uint8(9)
+    out = (data[index] ^ stream).tobytes()
+    return [bytearray(out[start:start + length]) for start, length in zip(starts.tolist(), lengths.tolist())]
@@ -1,5 +1,7 @@
 import collections
+import re
 from . import constants
+from .crypt import crypt_string
 
 
 control_codes = collections.OrderedDict()
@@ -45,6 +47,61 @@ control_codes[bytes([0xff, 44])] = b'\\Roman'
 control_codes[bytes([0xff, 45])] = b'\\Roman'  # reset code
 
 
+# Control codes by their second byte, for decoding in one pass over the 0xFF escapes.
+_control_decode = [None] * 256
+for _code, _replacement in control_codes.items():
+    _control_decode[_code[1]] = _replacement
+
+# One alternation of every replacement, in control_codes order: where several start at the same backslash the first
+# listed wins, as it did when they were replaced one after another (so \the encodes as \th followed by e).
+_control_encode = {}
+for _code, _replacement in control_codes.items():
+    _control_encode.setdefault(_replacement, _code)
+_control_encode_re = re.compile(b"|".join(re.escape(replacement) for replacement in _control_encode))
+
+
+# Replaces the control codes of decrypted bytes with their byond equivalents. Returns None if the data ends in a lone
+# 0xFF escape.
+def decode_control_codes(data):
+    if 0xff not in data:
+        return data.decode('iso-8859-1')
+    parts = bytes(data).split(b'\xff')
+    ret = [parts[0]]
+    for i in range(1, len(parts)):
+        part = parts[i]
+        if not part:
+            if i == len(parts) - 1:
+                return None
+            raise ValueError("Found unhandled control code: {0}".format(0xff))
+        replacement = _control_decode[part[0]]
+        if replacement is None:
+            raise ValueError("Found unhandled control code: {0}".format(part[0]))
+        ret.append(replacement)
+        ret.append(part[1:])
+    return b''.join(ret).decode('iso-8859-1')
+
+
+def encode_control_codes(string):
+    data = string.encode('iso-8859-1')
+    if b'\\' not in data:
+        return data
+    return _control_encode_re.sub(lambda m: _control_encode[m.group()], data)
+
+
+# Decodes a whole table of decrypted strings, like RawString.decode on each.
+def decode_strings(strings):
+    decode = decode_control_codes
+    ret = []
+    for data in strings:
+        string = decode(data)
+        ret.append("?" if string is None else string)
+    return ret
+
+
+def encode_strings(strings):
+    return [encode_control_codes(string) for string in strings]
+
+
 class RawString:
     def __init__(self, byte, key, mode=constants.raw_string_mode_encrypted, lazy=False):
         self.key = key
@@ -75,10 +132,8 @@ class RawString:
     def decrypt(self, force=False):
         if not force and self.data is not None:
             return self.data
-        self.data = bytearray(self.orig_data)
-        for i in range(len(self.orig_data)):
-            self.data[i] = (self.orig_data[i] ^ self.key) & 0xFF
-            self.key += 9
+        self.data = crypt_string(self.orig_data, self.key)
+        self.key += 9 * len(self.orig_data)
         return self.data
 
     # data (decrypted bytes) -> orig_data (encrypted bytes)
@@ -87,10 +142,8 @@ class RawString:
             self.encode()
         if not force and self.orig_data is not None:
             return self.orig_data
-        self.orig_data = bytearray(self.data)
-        for i in range(len(self.data)):
-            self.orig_data[i] = (self.data[i] ^ self.key) & 0xFF
-            self.key += 9
+        self.orig_data = crypt_string(self.data, self.key)
+        self.key += 9 * len(self.data)
         return self.orig_data
 
     # data (decrypted bytes) -> string (human-readable string)
@@ -98,25 +151,17 @@ class RawString:
         if self.data is None:
             self.decrypt()
         if self.string is None or force:
-            temp = bytearray(self.data)
-            for code, replacement in control_codes.items():
-                temp = temp.replace(code, replacement)
-            ccindex = temp.find(bytes([0xff]))
-            if ccindex != -1:
-                if len(temp) > ccindex + 1:
-                    raise ValueError("Found unhandled control code: {0}".format(self.data[ccindex + 1]))
-                else:
-                    return "?"
-            self.string = temp.decode('iso-8859-1')
+            string = decode_control_codes(self.data)
+            if string is None:
+                return "?"
+            self.string = string
             self.key = self.orig_key
         return self.string
 
     # string (human-readable string) -> data (decrypted bytes)
     def encode(self, force=False):
         if self.data is None or force:
-            self.data = self.string.encode('iso-8859-1')
-            for code, replacement in control_codes.items():
-                self.data = self.data.replace(replacement, code)
+            self.data = encode_control_codes(self.string)
             self.key = self.orig_key
         return self.data
 
@@ -130,7 +175,29 @@ class RawString:
         return "RawString(b'{0}',{1})".format(self.orig_data, self.orig_key)
 
 
+# A container attribute kept in a slot that stays None until the container is first used, so the many records that
+# never get an entry do not each carry an empty dict or list.
+class lazy_container:
+    def __init__(self, slot, factory):
+        self.slot = slot
+        self.factory = factory
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if value is None:
+            value = self.factory()
+            setattr(obj, self.slot, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+
 class Mob:
+    __slots__ = ("_unknown", "_fdata1", "_fdata2")
+
     def __init__(self):
         self._unknown = 0
         self._fdata1 = 0
@@ -138,6 +205,8 @@ class Mob:
 
 
 class Resource:
+    __slots__ = ("typeid", "hash")
+
     def __init__(self, typeid, rhash):
         self.typeid = typeid
         self.hash = rhash
@@ -237,6 +306,12 @@ class Arg:
 
 
 class Proc:
+    __slots__ = ("path", "name", "desc", "category", "data", "variable_list", "argument_list", "range", "access", "flags", "_ufield3",
+                 "ext_flags", "invisibility", "id", "_parameters", "argproc_id", "_locals", "defined_on")
+
+    parameters = lazy_container("_parameters", list)
+    locals = lazy_container("_locals", list)
+
     def __init__(self):
         self.path = 0
         self.name = 0
@@ -259,9 +334,9 @@ class Proc:
 
         self.id = 0
 
-        self.parameters = []
+        self._parameters = None
         self.argproc_id = None
-        self.locals = []
+        self._locals = None
         self.defined_on = None
 
     def __json__(self):
@@ -299,18 +374,28 @@ class Proc:
 
 
 class Var:
+    __slots__ = ("value", "name")
+
     def __init__(self):
         self.value = None,
         self.name = 0
 
 
 class Instance:
+    __slots__ = ("value", "initializer")
+
     def __init__(self):
         self.value = None,
         self.initializer = 0
 
 
 class WorldData:
+    __slots__ = ("world_version", "min_server", "min_client", "map_x", "map_y", "map_z", "default_mob", "default_turf", "default_area",
+                 "world_procs", "global_init", "world_domain", "world_name", "tick_lag", "unknown1", "client_type", "image_type",
+                 "lazy_eye", "client_dir", "control_freak", "unknown2", "client_script", "unknown3", "view_width", "view_height",
+                 "hub_password", "world_status", "unknown4", "unknown5", "version", "cache_lifespan", "default_command_text",
+                 "default_command_prompt", "hub_path", "unknown6", "unknown7", "icon_width", "icon_height", "map_format")
+
     def __init__(self):
         self.world_version = 0
         self.min_server = 0
@@ -355,11 +440,15 @@ class WorldData:
 
 
 class Tile:
+    __slots__ = ("area", "turf", "unknown", "_instances")
+
+    instances = lazy_container("_instances", list)
+
     def __init__(self, area_id=0, turf_id=0, unknown_id=0):
         self.area = area_id
         self.turf = turf_id
         self.unknown = unknown_id
-        self.instances = []
+        self._instances = None
 
 
 def extract_pids(pdict):
@@ -367,6 +456,15 @@ def extract_pids(pdict):
 
 
 class Type:
+    # use_color_matrix and color_matrix are only set for worlds that store them (min_client above 508).
+    __slots__ = ("path", "parent", "name", "desc", "icon", "icon_state", "dir", "text", "suffix", "maptext", "maptext_width",
+                 "maptext_height", "maptext_x", "maptext_y", "flags", "proc_list", "verb_list", "variable_list", "layer",
+                 "builtin_variable_list", "id", "resolved_vars", "variables", "procedures", "verbs", "_procedures_own", "_verbs_own",
+                 "_unknown1", "_unknown2", "_unknown3", "_unknown4", "_fdata1", "_fdata4", "use_color_matrix", "color_matrix")
+
+    procedures_own = lazy_container("_procedures_own", dict)
+    verbs_own = lazy_container("_verbs_own", dict)
+
     def __init__(self, path, parent):
         self.path = path
         self.parent = parent
@@ -398,8 +496,8 @@ class Type:
         self.variables = None
         self.procedures = None
         self.verbs = None
-        self.procedures_own = {}
-        self.verbs_own = {}
+        self._procedures_own = None
+        self._verbs_own = None
 
         self._unknown1 = 0
         self._unknown2 = 0
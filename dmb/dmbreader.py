@@ -1,22 +1,28 @@
-from .dmb import Tile, Mob, Proc, WorldData, Var, Instance, Resource, Type, RawString
+from .dmb import Tile, Mob, Proc, WorldData, Var, Instance, Resource, Type, RawString, decode_strings
 from .dmbwriter import DmbWriter
 from .tree import ObjectTree
 from .value import *
 from .constants import *
-from .crypt import byond32
+from .crypt import Byond32, decrypt_strings
+from . import columnar as columnar_tables
+from .cache import CacheFormatError, ParseCache, default_cache_size, encode_tables
+from .lazystrings import LazyStringTable, default_string_cache_size
+from .stats import Stats
 
 try:
     from blist import *
 except:
     blist = list
 
-try:
-    import numpy as np
-except:
-    from . import np_fallback as np
-
-import re
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import gc
 import io
+import re
+import mmap
+import os
 import struct
 import time
 
@@ -25,6 +31,49 @@ class DmbFileError(ValueError):
     pass
 
 
+_uint8_struct = struct.Struct('<B')
+_uint16_struct = struct.Struct('<H')
+_uint32_struct = struct.Struct('<I')
+_float32_struct = struct.Struct('<f')
+
+
+# Fixed-width parts of every record kind, compiled once per file for its bit width and client version.
+class RecordLayouts:
+    def __init__(self, bit32, min_client):
+        a = "I" if bit32 else "H"
+        self.arch = struct.Struct("<" + a)
+        self.tile = struct.Struct("<" + a * 3 + "B")
+        # path, parent, name, desc, icon, icon_state, dir, _unknown1
+        self.type_head = struct.Struct("<" + a * 6 + "BB")
+        # text, suffix, maptext_width, maptext_height, [maptext_x, maptext_y,] maptext, flags, verb_list, proc_list,
+        # _unknown3, _unknown4, variable_list, layer
+        self.type_maptext_offset = min_client > 507
+        self.type_body = struct.Struct("<" + a * 2 + "HH" + ("HH" if self.type_maptext_offset else "") + a + "I" + a * 5 + "f")
+        self.type_unknown2 = min_client >= 500
+        self.type_color_matrix = min_client > 508
+        # path, name, desc, category, range, access, flags
+        self.proc_head = struct.Struct("<" + a * 4 + "BBB")
+        # ext_flags, invisibility
+        self.proc_ext = struct.Struct("<IB")
+        # data, variable_list, argument_list
+        self.proc_tail = struct.Struct("<" + a * 3)
+        # typeid, value, name / initializer
+        self.value = struct.Struct("<BI" + a)
+        # move, instance
+        self.mappop = struct.Struct("<H" + a)
+        # hash, typeid
+        self.resource = struct.Struct("<IB")
+
+
+# Decrypts and decodes one chunk of the string table in a worker process. Span offsets are relative to region; keys
+# stay absolute. The decrypted bytes are sent back as well when the caller needs them for the CRC.
+def _decode_string_chunk(region, spans, string_mode, keep_decrypted):
+    decrypted = decrypt_strings(region, spans)
+    if string_mode != string_mode_strings:
+        return decrypted, None
+    return decode_strings(decrypted), decrypted if keep_decrypted else None
+
+
 class TileGenerator:
     def __init__(self, reader, count):
         self.reader = reader
@@ -36,8 +85,8 @@ class TileGenerator:
     def gen(self, count):
         while self.len > 0 and count > 0:
             if self.curr is None or self.rle_count == 0:
-                self.curr = (self.reader._uarch(), self.reader._uarch(), self.reader._uarch())
-                self.rle_count = self.reader._uint8()
+                area, turf, unknown, self.rle_count = self.reader._unpack(self.reader.layouts.tile)
+                self.curr = (area, turf, unknown)
             self.rle_count -= 1
             self.len -= 1
             count -= 1
@@ -45,127 +94,562 @@ class TileGenerator:
             yield Tile(self.curr[0], self.curr[1], self.curr[2])
 
 
+# Sections in file order. "mappops" and "world" are scanned like the others but have no attribute of their own: map
+# population is applied to the tiles and the extended world data is always parsed into self.world.
+section_order = ["tiles", "types", "mobs", "strings", "data", "procs", "variables", "argprocs", "instances", "mappops", "world", "resources"]
+parallel_string_chunk = 4096  # smallest number of strings handed to a worker
+throttle_ops = 2000  # records handled between pauses when throttled
+lazy_sections = ["tiles", "types", "mobs", "strings", "data", "procs", "variables", "argprocs", "instances", "resources"]
+
+
+class Section:
+    def __init__(self, name, offset, count):
+        self.name = name
+        self.offset = offset  # offset of the first record, after the record count
+        self.count = count
+        self.end = None
+
+    def __repr__(self):
+        return "Section({0}, offset={1}, count={2}, end={3})".format(repr(self.name), self.offset, self.count, self.end)
+
+
+peek_length = 256  # enough for the version lines, flags and map size
+
+
+class DmbHeader:
+    def __init__(self, world, flags, sections=None):
+        self.world = world
+        self.flags = flags
+        self.bit32 = (flags & 0x40000000) > 0
+        self.sections = sections
+
+    def __repr__(self):
+        return "DmbHeader(v{0}, {1}-bit, {2}x{3}x{4})".format(self.world.world_version, 32 if self.bit32 else 16, self.world.map_x, self.world.map_y, self.world.map_z)
+
+
 class Dmb:
-    def __init__(self, dmbname, throttle=False, verbose=False, string_mode=string_mode_default, check_string_crc=False):
+    def __init__(self, dmbname, throttle=False, verbose=False, string_mode=string_mode_default, check_string_crc=False, use_mmap=True, sections=None, columnar=False, buffer=None, fileobj=None, workers=None, cache_dir=None, cache_size=default_cache_size, instrument=None, profile_memory=False, string_cache_size=default_string_cache_size):
+        if columnar and columnar_tables.np is None:
+            raise ImportError("Columnar mode requires numpy.")
         self.string_mode = string_mode if string_mode != string_mode_default else string_mode_byte_strings
         self.check_string_crc = check_string_crc
-        self.reader = open(dmbname, 'rb')
-        self.bit32 = False
+        self.columnar = columnar
+        self.workers = workers
+        self.string_cache_size = string_cache_size
+        self.verbose = verbose
         self.throttle = throttle
         self.ops = 0
-        self.world = WorldData()
-        self._parse_version_data()
+        self.offset = 0
+        self.bit32 = False
+        self.stats = Stats(instrument, profile_memory)
+        self._mmap = None
+        self._mapped = None
+        self._cache_entry = None
+        self._values = new_value_cache()  # decoded values, shared by vars, instances and columnar rows
+        self.buffer = None
+        if sections is None:
+            sections = lazy_sections
+        for name in sections:
+            if name not in lazy_sections:
+                raise ValueError("Unknown dmb section: {0}".format(name))
+        self.no_parent_type = Type("/", None)
+        cache = None
+        if cache_dir is not None and dmbname is not None:
+            started = self.stats.start()
+            cache = ParseCache(cache_dir, cache_size)
+            cache_key = cache.key(dmbname, (self.string_mode, self.check_string_crc, self.columnar))
+            entry = cache.load(cache_key)
+            self.stats.record("cache load", started)
+            if entry is not None and self._restore(entry, sections):
+                return
+        started = self.stats.start()
+        if buffer is not None:
+            self.buffer = memoryview(buffer).cast('B')
+        elif fileobj is not None:
+            self._open_fileobj(fileobj, use_mmap)
+        else:
+            self._open(dmbname, use_mmap)
+        self.stats.record("open", started, offset=0, end=len(self.buffer))
+        started = self.stats.start()
+        self._parse_header()
+        self.stats.record("header", started, offset=0, end=self.offset)
         if verbose:
             print("Compiled with byond {0} (requires {1} server, {2} client)".format(self.world.world_version, self.world.min_server, self.world.min_client))
+            print("{0}-bit dmb".format(32 if self.bit32 else 16))
 
+        self.sections = collections.OrderedDict()
+        self._scan(set(sections))
+        if cache is not None:
+            started = self.stats.start()
+            try:
+                cache.store(cache_key, self._cache_state())
+            except (CacheFormatError, OSError):
+                pass
+            self.stats.record("cache store", started)
+
+    # Loads every section and encodes them for the parse cache.
+    def _cache_state(self):
+        for name in lazy_sections:
+            getattr(self, name)
+        return encode_tables(self, lazy_sections)
+
+    # Takes the world data and section table from a parse cache entry and restores the eager sections from it; the rest
+    # are restored when first used. An entry that cannot be restored is a miss: False is returned and the file is parsed.
+    def _restore(self, entry, sections):
+        try:
+            world = entry.world()
+            restored = collections.OrderedDict()
+            for name, offset, count, end in entry.header["sections"]:
+                restored[name] = Section(name, offset, count)
+                restored[name].end = end
+            self.world = world
+            self.flags = entry.header["flags"]
+            self.bit32 = entry.header["bit32"]
+            self.strcrc = entry.header["strcrc"]
+            self.layouts = RecordLayouts(self.bit32, self.world.min_client)
+            self.sections = restored
+            entry.values = self._values
+            self._cache_entry = entry
+            for name in sections:
+                getattr(self, name)
+        except Exception:
+            for name in lazy_sections:
+                self.__dict__.pop(name, None)
+            self._cache_entry = None
+            return False
+        return True
+
+    def _parse_header(self):
+        self.world = WorldData()
+        self._parse_version_data()
         self.flags = self._uint32()
         self.world.map_x, self.world.map_y, self.world.map_z = (self._uint16(), self._uint16(), self._uint16())
         self.bit32 = (self.flags & 0x40000000) > 0
+        self.layouts = RecordLayouts(self.bit32, self.world.min_client)
+
+    # Reads only the version lines, flags and map size. With extended, the sections are skipped over (not parsed) to
+    # also read the extended world data and the section offset table.
+    @classmethod
+    def peek(cls, dmbname, extended=False):
+        if extended:
+            dmb = cls(dmbname, sections=[])
+            dmb.close()
+            return DmbHeader(dmb.world, dmb.flags, dmb.sections)
+        dmb = cls.__new__(cls)
+        with open(dmbname, 'rb') as f:
+            dmb.buffer = memoryview(f.read(peek_length))
+        dmb.offset = 0
+        dmb._parse_header()
+        return DmbHeader(dmb.world, dmb.flags)
+
+    # Walks the file once, recording where every section starts and ends. Sections in eager are parsed on the way,
+    # the rest are only skipped over and get parsed from their recorded offset on first attribute access.
+    def _scan(self, eager):
+        self._scan_section("tiles", self.world.map_x * self.world.map_y * self.world.map_z, eager)
+        self._uint32()  # drop this
 
-        if verbose:
-            print("{0}-bit dmb".format(32 if self.bit32 else 16))
+        for name in ["types", "mobs", "strings", "data", "procs", "variables", "argprocs", "instances"]:
+            self._scan_section(name, self._uarch(), eager)
 
-        tilegen = TileGenerator(self, self.world.map_x * self.world.map_y * self.world.map_z)
-        self.tiles = [[[tile for tile in tilegen.gen(self.world.map_x)] for j in range(self.world.map_y)] for i in range(self.world.map_z)]
-        self._uint32()  # drop this
+        mappops = self._scan_section("mappops", self._uint32(), eager)
+        if "tiles" in self.__dict__:
+            self._populate_map(mappops)
 
-        self.no_parent_type = Type("/", None)
+        started = self.stats.start()
+        world = Section("world", self.offset, 1)
+        self.sections["world"] = world
+        self._parse_extended_data()
+        world.end = self.offset
+        self.stats.record("world", started, 1, world.offset, world.end)
+
+        self._scan_section("resources", self._uarch(), eager)
+
+    def _scan_section(self, name, count, eager):
+        section = Section(name, self.offset, count)
+        self.sections[name] = section
+        if self.verbose:
+            print("{0} {1} ({2})".format(count, name, hex(section.offset)))
+        if name in eager:
+            self._load_section(name)
+            self.offset = section.end
+        else:
+            started = self.stats.start()
+            self._section_skippers[name](self, count)
+            section.end = self.offset
+            self.stats.record("skip " + name, started, count, section.offset, section.end)
+        return section
+
+    def __getattr__(self, name):
+        if name in lazy_sections and "sections" in self.__dict__ and name in self.sections:
+            return self._load_section(name)
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+    def _load_section(self, name):
+        if self._cache_entry is not None:
+            return self._restore_section(name)
+        if self.buffer is None:
+            raise DmbFileError("Cannot load section {0}, the dmb has already been closed.".format(name))
+        section = self.sections[name]
+        offset = self.offset
+        self.offset = section.offset
+        started = self.stats.start()
+        try:
+            value = self._section_loaders[name](self, section.count)
+            if section.end is None:
+                section.end = self.offset
+            setattr(self, name, value)
+            self.stats.record(name, started, section.count, section.offset, section.end)
+            if name == "tiles" and "mappops" in self.sections:
+                self._populate_map(self.sections["mappops"])
+        finally:
+            self.offset = offset
+        return value
+
+    # The collector is paused while a section is rebuilt: every object created is reachable and acyclic, and the
+    # collections triggered by that many allocations would otherwise take longer than the restore itself.
+    def _restore_section(self, name):
+        section = self.sections[name]
+        started = self.stats.start()
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            value = self._cache_entry.restore(self, name)
+        finally:
+            if collecting:
+                gc.enable()
+        if isinstance(value, list) and name != "tiles":
+            value = blist(value)
+        setattr(self, name, value)
+        self.stats.record(name, started, section.count)
+        if name == "tiles" and "mappops" in self.sections:
+            self._populate_map(self.sections["mappops"])
+        return value
+
+    def _load_tiles(self, count):
+        if self.columnar:
+            return self._load_tile_grid(count)
+        tilegen = TileGenerator(self, count)
+        return [[[tile for tile in tilegen.gen(self.world.map_x)] for j in range(self.world.map_y)] for i in range(self.world.map_z)]
+
+    # Every RLE run is a fixed-width record, so all runs that could fit are viewed at once and the run that completes the
+    # map is found from the running total of the counts.
+    def _load_tile_grid(self, count):
+        dtype = columnar_tables.tile_run_dtype(self.bit32)
+        available = min(count, (len(self.buffer) - self.offset) // dtype.itemsize)
+        runs = columnar_tables.np.frombuffer(self.buffer, dtype=dtype, count=available, offset=self.offset)
+        totals = columnar_tables.np.cumsum(runs["count"], dtype=columnar_tables.np.int64)
+        run_count = int(columnar_tables.np.searchsorted(totals, count)) + 1 if count else 0
+        if run_count > len(runs):
+            raise EOFError("Read beyond end of file.")
+        self.offset += run_count * dtype.itemsize
+        return columnar_tables.TileGrid.from_runs(runs[:run_count], (self.world.map_z, self.world.map_y, self.world.map_x))
 
-        type_count = self._uarch()
-        if verbose:
-            print("{0} types ({1})".format(type_count, hex(self.reader.seek(0, io.SEEK_CUR))))
-        self.types = blist([t for t in self._typegen(type_count)])
+    def _load_types(self, count):
+        return blist([t for t in self._typegen(count)])
 
-        mob_count = self._uarch()
-        if verbose:
-            print("{0} mobs ({1})".format(mob_count, hex(self.reader.seek(0, io.SEEK_CUR))))
-        self.mobs = blist([m for m in self._mobgen(mob_count)])
+    def _load_mobs(self, count):
+        return blist([m for m in self._mobgen(count)])
 
-        self.strcrc = np.uint32(0)
-        string_count = self._uarch()
-        if verbose:
-            print("{0} strings".format(string_count))
-        self.strings = blist([s for s in self._stringgen(string_count)])
+    def _load_strings(self, count):
+        self._string_crc = Byond32()
+        spans = list(self._stringspans(count))
+        if self.string_mode == string_mode_lazy:
+            if self.check_string_crc:
+                self._crc(decrypt_strings(self.buffer, spans))
+            strings = LazyStringTable(self.buffer, spans, self.string_cache_size)
+        elif self.workers is not None and self.workers > 1 and len(spans) > parallel_string_chunk:
+            strings = self._decode_strings_parallel(spans)
+        else:
+            # Throttled loads decrypt and decode throttle_ops strings at a time, pausing between batches.
+            batch = throttle_ops if self.throttle else max(len(spans), 1)
+            strings = blist()
+            for first in range(0, len(spans), batch):
+                decrypted = decrypt_strings(self.buffer, spans[first:first + batch])
+                if self.check_string_crc:
+                    self._crc(decrypted)
+                if self.string_mode == string_mode_strings:
+                    decrypted = decode_strings(decrypted)
+                strings.extend(decrypted)
+                self._throttle(len(decrypted))
         crc = self._uint32()  # CRC
+        self.strcrc = self._string_crc.digest()
         if self.check_string_crc:
             if crc != self.strcrc:
                 raise DmbFileError("String table CRC mismatch (expected: {0}, got: {1})".format(crc, self.strcrc))
-            elif verbose:
+            elif self.verbose:
                 print("String table CRC check passed.")
+        return strings
+
+    def _decode_strings_parallel(self, spans):
+        size = max(parallel_string_chunk, len(spans) // (self.workers * 4) + 1)
+        chunks = []
+        for first in range(0, len(spans), size):
+            chunk = spans[first:first + size]
+            base = chunk[0][0]
+            end = chunk[-1][0] + chunk[-1][1]
+            chunks.append((bytes(self.buffer[base:end]), [(offset - base, strlen, key) for offset, strlen, key in chunk]))
+        strings = blist()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(_decode_string_chunk, region, chunk, self.string_mode, self.check_string_crc) for region, chunk in chunks]
+            for future in futures:
+                decoded, decrypted = future.result()
+                if self.check_string_crc:
+                    self._crc(decrypted if decrypted is not None else decoded)
+                strings.extend(decoded)
+        return strings
+
+    def _load_data(self, count):
+        return blist([d for d in self._datagen(count)])
+
+    def _load_procs(self, count):
+        return blist([p for p in self._procgen(count)])
+
+    def _load_variables(self, count):
+        if self.columnar:
+            return columnar_tables.VarTable(self._frombuffer(columnar_tables.var_dtype(self.bit32), count), self._values)
+        records = self._unpack_records(self.layouts.value, count)
+        ret = blist()
+        for (typeid, typeval, name), value in zip(records, decode_values(((typeid, typeval) for typeid, typeval, name in records), self._values)):
+            var = Var()
+            var.name = name
+            var.value = value
+            ret.append(var)
+            self._throttle()
+        return ret
 
-        data_count = self._uarch()
-        if verbose:
-            print("{0} data".format(data_count))
-        self.data = blist([d for d in self._datagen(data_count)])
+    def _load_argprocs(self, count):
+        if self.columnar:
+            return columnar_tables.ColumnarTable(self._frombuffer(columnar_tables.arch_dtype(self.bit32), count))
+        return blist([v for v in self._argprocgen(count)])
+
+    def _load_instances(self, count):
+        if self.columnar:
+            return columnar_tables.InstanceTable(self._frombuffer(columnar_tables.instance_dtype(self.bit32), count), self._values)
+        records = self._unpack_records(self.layouts.value, count)
+        ret = blist()
+        for (typeid, typeval, initializer), value in zip(records, decode_values(((typeid, typeval) for typeid, typeval, initializer in records), self._values)):
+            instance = Instance()
+            instance.initializer = initializer
+            instance.value = value
+            ret.append(instance)
+            self._throttle()
+        return ret
 
-        proc_count = self._uarch()
-        if verbose:
-            print("{0} procs".format(proc_count))
-        self.procs = blist([p for p in self._procgen(proc_count)])
+    def _load_resources(self, count):
+        if self.columnar:
+            return columnar_tables.ResourceTable(self._frombuffer(columnar_tables.resource_dtype(), count))
+        return blist([r for r in self._resourcegen(count)])
 
-        var_count = self._uarch()
-        if verbose:
-            print("{0} vars".format(var_count))
-        self.variables = blist([v for v in self._vargen(var_count)])
+    # Zero-copy view of count fixed-width records at the current offset.
+    def _frombuffer(self, dtype, count):
+        try:
+            array = columnar_tables.np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.offset)
+        except ValueError:
+            raise EOFError("Read beyond end of file.")
+        self.offset += array.nbytes
+        if self._mmap is not None:
+            array = array.copy()
+        return array
+
+    _section_loaders = {
+        "tiles": _load_tiles,
+        "types": _load_types,
+        "mobs": _load_mobs,
+        "strings": _load_strings,
+        "data": _load_data,
+        "procs": _load_procs,
+        "variables": _load_variables,
+        "argprocs": _load_argprocs,
+        "instances": _load_instances,
+        "resources": _load_resources,
+    }
+
+    def _skip_tiles(self, count):
+        while count > 0:
+            self._ffwdarch(12, 6)
+            count -= self._uint8()
 
-        argproc_count = self._uarch()
-        if verbose:
-            print("{0} argprocs".format(argproc_count))
-        self.argprocs = blist([v for v in self._argprocgen(argproc_count)])
+    def _skip_types(self, count):
+        layouts = self.layouts
+        while count > 0:
+            self._ffwd(layouts.type_head.size - 1)
+            if self._uint8() == 15:
+                self._ffwd(4)
+            self._ffwd(layouts.type_body.size)
+            if layouts.type_unknown2:
+                if self._uint8() > 0:
+                    self._ffwd(24)
+            if layouts.type_color_matrix:
+                if self._uint8() > 0:
+                    self._ffwd(80)
+            self._ffwdarch(4, 2)
+            count -= 1
 
-        instance_count = self._uarch()
-        if verbose:
-            print("{0} instances".format(instance_count))
-        self.instances = blist([i for i in self._instancegen(instance_count)])
+    def _skip_mobs(self, count):
+        while count > 0:
+            self._ffwdarch(8, 4)
+            if (self._uint8() & 0x80) > 0:
+                self._ffwd(6)
+            count -= 1
 
-        mappop_count = self._uint32()
-        if verbose:
-            print("{0} mappops".format(mappop_count))
-        self._populate_map(mappop_count)
+    def _skip_strings(self, count):
+        for span in self._stringspans(count):
+            pass
+        self._uint32()  # CRC
 
-        self._parse_extended_data()
+    def _skip_data(self, count):
+        mult = 4 if self.bit32 else 2
+        while count > 0:
+            self._ffwd(self._uint16() * mult)
+            count -= 1
 
-        res_count = self._uarch()
-        if verbose:
-            print("{0} resources".format(res_count))
-        self.resources = blist([r for r in self._resourcegen(res_count)])
-
-        self.reader.close()
-        self.reader = None
-
-    def __del__(self):
-        if self.reader is not None:
-            self.reader.close()
-
-    def _shift_coords(self, move_count, x, y, z):
-        x += move_count
-
-        while x >= self.world.map_x:
-            x -= self.world.map_x
-            y += 1
-        while x < 0:
-            x += self.world.map_x
-            y -= 1
-
-        while y >= self.world.map_y:
-            y -= self.world.map_y
-            z += 1
-        while y < 0:
-            y += self.world.map_y
-            z -= 1
-
-        return (x, y, z)
-
-    def _populate_map(self, count):
-        x = 0
-        y = 0
-        z = 0
-        tile = self.tile(x, y, z)
-        for move_count, instanceid in self._mappopgen(count):
-            if move_count > 0:
-                x, y, z = self._shift_coords(move_count, x, y, z)
-                tile = self.tile(x, y, z)
-            tile.instances.append(self._resolve_instance(instanceid))
+    def _skip_procs(self, count):
+        layouts = self.layouts
+        while count > 0:
+            self._ffwd(layouts.proc_head.size - 1)
+            if (self._uint8() & 0x80) > 0:
+                self._ffwd(layouts.proc_ext.size)
+            self._ffwd(layouts.proc_tail.size)
+            count -= 1
+
+    def _skip_variables(self, count):
+        self._ffwd(count * self.layouts.value.size)
+
+    def _skip_argprocs(self, count):
+        self._ffwd(count * self.layouts.arch.size)
+
+    def _skip_mappops(self, count):
+        self._ffwd(count * self.layouts.mappop.size)
+
+    def _skip_resources(self, count):
+        self._ffwd(count * self.layouts.resource.size)
+
+    _section_skippers = {
+        "tiles": _skip_tiles,
+        "types": _skip_types,
+        "mobs": _skip_mobs,
+        "strings": _skip_strings,
+        "data": _skip_data,
+        "procs": _skip_procs,
+        "variables": _skip_variables,
+        "argprocs": _skip_argprocs,
+        "instances": _skip_variables,
+        "mappops": _skip_mappops,
+        "resources": _skip_resources,
+    }
+
+    # Maps the file read-only when possible, otherwise reads it into memory in one call. Loaded records hold copies, so
+    # only lazy sections, lazy strings and iter_records read from the mapping after the eager parse.
+    def _open(self, dmbname, use_mmap):
+        with open(dmbname, 'rb') as f:
+            self._open_fileobj(f, use_mmap)
+
+    # Only plain files read from their start can be mapped; pipes, sockets, archive members and in-memory streams are
+    # read. GzipFile and the like hand out the descriptor of the compressed file from fileno(), so the stream itself
+    # has to be a (buffered) FileIO.
+    def _open_fileobj(self, f, use_mmap):
+        raw = f.raw if isinstance(f, (io.BufferedReader, io.BufferedRandom)) else f
+        if use_mmap and isinstance(raw, io.FileIO):
+            try:
+                if f.tell() == 0:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._mapped = os.fstat(f.fileno())
+            except (ValueError, OSError):
+                self._mmap = None
+        if self._mmap is not None:
+            self.buffer = memoryview(self._mmap)
+        else:
+            self.buffer = memoryview(f.read()).cast('B')
+
+    # Scans the file and then parses one section at a time in executor (the loop's default executor when None), so the
+    # event loop keeps running between sections instead of sleeping in _throttle.
+    @classmethod
+    async def load_async(cls, dmbname, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        sections = kwargs.pop("sections", None)
+        if sections is None:
+            sections = lazy_sections
+        dmb = await loop.run_in_executor(executor, functools.partial(cls, dmbname, sections=[], **kwargs))
+        for name in lazy_sections:
+            if name in sections and name not in dmb.__dict__:
+                await loop.run_in_executor(executor, dmb._load_section, name)
+        return dmb
+
+    @classmethod
+    def from_bytes(cls, data, **kwargs):
+        return cls(None, buffer=data, **kwargs)
+
+    @classmethod
+    def from_buffer(cls, buffer, **kwargs):
+        return cls(None, buffer=buffer, **kwargs)
+
+    @classmethod
+    def from_fileobj(cls, fileobj, **kwargs):
+        return cls(None, fileobj=fileobj, **kwargs)
+
+    def close(self):
+        if self.string_mode == string_mode_lazy and "strings" in self.__dict__:
+            self.strings.close()
+        self.buffer = None
+        self._mmap = None
+        self._mapped = None
+
+    # Ids of all number-valued vars and their values as a float32 array, read straight from the columns in columnar mode.
+    def numeric_variables(self):
+        return self._numbers(self.variables)
+
+    def numeric_instances(self):
+        return self._numbers(self.instances)
+
+    def _numbers(self, table):
+        np = columnar_tables.np
+        if np is None:
+            raise ImportError("Numeric views require numpy.")
+        if self.columnar:
+            return columnar_tables.number_columns(table.array)
+        ids = [i for i, record in enumerate(table) if isinstance(record.value, value_number)]
+        raw = np.array([table[i].value._value for i in ids], dtype="<u4")
+        return np.array(ids, dtype=np.int64), raw.view("<f4")
+
+    # Prints the memory retained by every phase so far; needs profile_memory.
+    def memory_report(self):
+        print(self.stats.memory_report())
+
+    def _populate_map(self, section):
+        if section.count == 0:
+            return
+        started = self.stats.start()
+        self._place_instances(section)
+        self.stats.record("mappops", started, section.count, section.offset, section.end)
+
+    # Map pops are (move, instance) pairs where move advances a cursor over the tiles in x, y, z order. The cursor is
+    # the running sum of the moves, so each pair's tile follows from integer division instead of stepping through rows.
+    def _place_instances(self, section):
+        if self._cache_entry is not None:
+            moves, instance_ids = self._cache_entry.mappops()
+            pops = zip(moves, instance_ids)
+        elif self.columnar:
+            offset = self.offset
+            self.offset = section.offset
+            pops = self._frombuffer(columnar_tables.mappop_dtype(self.bit32), section.count)
+            self.offset = offset
+            moves, instance_ids = pops["move"], pops["instance"]
+        else:
+            layout = self.layouts.mappop
+            pops = layout.iter_unpack(self.buffer[section.offset:section.offset + section.count * layout.size])
+        if self.columnar:
+            np = columnar_tables.np
+            self.tiles.index_instances(np.cumsum(np.asarray(moves), dtype=np.int64), np.asarray(instance_ids), self.instances)
+            return
+        tiles = self.tiles
+        row = self.world.map_x
+        plane = self.world.map_x * self.world.map_y
+        linear = 0
+        for move_count, instanceid in pops:
+            linear += move_count
+            z, rest = divmod(linear, plane)
+            y, x = divmod(rest, row)
+            tiles[z][y][x].instances.append(self._resolve_instance(instanceid))
 
     def _unpack_arch(self, bs):
         return struct.unpack("<" + (("I" if self.bit32 else "H") * int(len(bs) / (4 if self.bit32 else 2))), bs)
@@ -175,6 +659,15 @@ class Dmb:
             z = x[2]
             y = x[1]
             x = x[0]
+        if self.columnar:
+            z_range, y_range, x_range = self.tiles.area.shape
+            if z < 0 or z >= z_range:
+                raise IndexError("Z out of map range.")
+            if y < 0 or y >= y_range:
+                raise IndexError("Y out of map range.")
+            if x < 0 or x >= x_range:
+                raise IndexError("X out of map range.")
+            return self.tiles.tile(x, y, z)
         if z > len(self.tiles):
             raise IndexError("Z out of map range.")
         if y > len(self.tiles[z]):
@@ -183,14 +676,39 @@ class Dmb:
             raise IndexError("X out of map range.")
         return self.tiles[z][y][x]
 
+    def region(self, z, x0, y0, x1, y1):
+        if not self.columnar:
+            raise TypeError("Region queries need a columnar Dmb.")
+        return self.tiles.region(z, x0, y0, x1, y1)
+
+    def tiles_at(self, coords):
+        if not self.columnar:
+            raise TypeError("Region queries need a columnar Dmb.")
+        return self.tiles.tiles_at(coords)
+
     def _uarch(self):
-        if self.bit32:
-            return self._uint32()
-        else:
-            return self._uint16()
+        return self._unpack(self.layouts.arch)[0]
+
+    def _unpack(self, layout):
+        offset = self.offset
+        self.offset = offset + layout.size
+        try:
+            return layout.unpack_from(self.buffer, offset)
+        except struct.error:
+            raise EOFError("Read beyond end of file.")
+
+    # All count records of a fixed-width section at once.
+    def _unpack_records(self, layout, count):
+        offset = self.offset
+        end = offset + count * layout.size
+        if end > len(self.buffer):
+            raise EOFError("Read beyond end of file.")
+        self.offset = end
+        return list(layout.iter_unpack(self.buffer[offset:end]))
 
     def _ffwd(self, seek):
-        return self.reader.seek(seek, io.SEEK_CUR)
+        self.offset += seek
+        return self.offset
 
     def _ffwdarch(self, seek32, seek16):
         seek = seek16
@@ -198,8 +716,11 @@ class Dmb:
             seek = seek32
         return self._ffwd(seek)
 
+    # Copies rather than slices, so loaded records never read from (or keep alive) a mapping of the file.
     def _nbytes(self, n):
-        return self.reader.read(n)
+        offset = self.offset
+        self.offset = offset + n
+        return bytes(self.buffer[offset:offset + n])
 
     def _nbytesarch(self, n32, n16):
         read = n16
@@ -208,31 +729,39 @@ class Dmb:
         return self._nbytes(read)
 
     def _float32(self):
-        b = self.reader.read(4)
-        if len(b) < 4:
+        offset = self.offset
+        self.offset = offset + 4
+        try:
+            return _float32_struct.unpack_from(self.buffer, offset)[0]    # interprets 4 bytes as little-endian float
+        except struct.error:
             raise EOFError("Read beyond end of file.")
-        return struct.unpack('<f', b)[0]    # interprets 4 bytes as little-endian float
 
     def _uint32(self):
-        b = self.reader.read(4)
-        if len(b) < 4:
+        offset = self.offset
+        self.offset = offset + 4
+        try:
+            return _uint32_struct.unpack_from(self.buffer, offset)[0]    # interprets 4 bytes as little-endian unsigned long
+        except struct.error:
             raise EOFError("Read beyond end of file.")
-        return struct.unpack('<I', b)[0]    # interprets 4 bytes as little-endian unsigned long
 
     def _uint16(self):
-        b = self.reader.read(2)
-        if len(b) < 2:
+        offset = self.offset
+        self.offset = offset + 2
+        try:
+            return _uint16_struct.unpack_from(self.buffer, offset)[0]    # interprets 2 bytes as little-endian unsigned short
+        except struct.error:
             raise EOFError("Read beyond end of file.")
-        return struct.unpack('<H', b)[0]    # interprets 2 bytes as little-endian unsigned short
 
     def _uint8(self):
-        b = self.reader.read(1)
-        if len(b) < 1:
+        offset = self.offset
+        self.offset = offset + 1
+        try:
+            return _uint8_struct.unpack_from(self.buffer, offset)[0]    # interprets 1 byte as an unsigned byte
+        except struct.error:
             raise EOFError("Read beyond end of file.")
-        return struct.unpack('<B', b)[0]    # interprets 1 byte as an unsigned byte
 
     def _byte(self):
-        return self.reader.read(1)
+        return self._nbytes(1)
 
     def _parse_version_data(self):
         ver_str = self._read_bytes_until(b'\x0A').decode('ascii')
@@ -284,56 +813,69 @@ class Dmb:
         self.world.icon_height = self._uint16()
         self.world.map_format = self._uint16()
 
-    def write(self, dmbname):
-        writer = DmbWriter(dmbname, self)
-        writer.write()
+    # Writing over the file this Dmb is mapped from would truncate it under the mapping, so that goes to a temporary file
+    # that then replaces it; the mapping keeps the old contents.
+    def write(self, dmbname, instrument=None):
+        if not self._maps(dmbname):
+            writer = DmbWriter(dmbname, self, instrument)
+            writer.write()
+            return writer.stats
+        temp = "{0}.{1}.tmp".format(dmbname, os.getpid())
+        try:
+            writer = DmbWriter(temp, self, instrument)
+            writer.write()
+            os.replace(temp, dmbname)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        return writer.stats
+
+    def _maps(self, dmbname):
+        if getattr(self, "_mapped", None) is None or self._mmap is None:
+            return False
+        try:
+            return os.path.samestat(self._mapped, os.stat(dmbname))
+        except OSError:
+            return False
 
-    def _throttle(self):
+    def _throttle(self, ops=1):
         if self.throttle:
-            self.ops += 1
-            if self.ops >= 2000:
+            self.ops += ops
+            if self.ops >= throttle_ops:
                 time.sleep(0.25)
                 self.ops = 0
 
     def _typegen(self, count):
+        layouts = self.layouts
         typeid = 0
         while count > 0:
-            path = self._uarch()
-            parent = self._uarch()
+            path, parent, name, desc, icon, icon_state, tdir, unknown1 = self._unpack(layouts.type_head)
             curr = Type(path, parent)
 
             curr.id = typeid
             typeid += 1
 
-            curr.name = self._uarch()
-            curr.desc = self._uarch()
-            curr.icon = self._uarch()
-            curr.icon_state = self._uarch()
-            curr.dir = self._uint8()
+            curr.name = name
+            curr.desc = desc
+            curr.icon = icon
+            curr.icon_state = icon_state
+            curr.dir = tdir
 
-            curr._unknown1 = self._uint8()
-            if curr._unknown1 == 15:
+            curr._unknown1 = unknown1
+            if unknown1 == 15:
                 curr._fdata1 = self._nbytes(4)
-            curr.text = self._uarch()
-            curr.suffix = self._uarch()  # suffix
-            curr.maptext_width = self._uint16()
-            curr.maptext_height = self._uint16()
-            if self.world.min_client > 507:
-                curr.maptext_x = self._uint16()
-                curr.maptext_y = self._uint16()
-            curr.maptext = self._uarch()
-            curr.flags = self._uint32()
-            curr.verb_list = self._uarch()
-            curr.proc_list = self._uarch()
-            curr._unknown3 = self._uarch()
-            curr._unknown4 = self._uarch()
-            curr.variable_list = self._uarch()
-            curr.layer = self._float32()
-            if self.world.min_client >= 500:
+            if layouts.type_maptext_offset:
+                (curr.text, curr.suffix, curr.maptext_width, curr.maptext_height, curr.maptext_x, curr.maptext_y, curr.maptext, curr.flags,
+                 curr.verb_list, curr.proc_list, curr._unknown3, curr._unknown4, curr.variable_list, curr.layer) = self._unpack(layouts.type_body)
+            else:
+                (curr.text, curr.suffix, curr.maptext_width, curr.maptext_height, curr.maptext, curr.flags,
+                 curr.verb_list, curr.proc_list, curr._unknown3, curr._unknown4, curr.variable_list, curr.layer) = self._unpack(layouts.type_body)
+            if layouts.type_unknown2:
                 curr._unknown2 = self._uint8()
                 if curr._unknown2 > 0:
                     curr._fdata4 = self._nbytes(24)
-            if self.world.min_client > 508:
+            if layouts.type_color_matrix:
                 curr.use_color_matrix = self._uint8()
                 if curr.use_color_matrix > 0:
                     curr.color_matrix = self._nbytes(80)
@@ -353,31 +895,45 @@ class Dmb:
             yield mob
             self._throttle()
 
-    def _crc(self, b):
-        self.strcrc = byond32(self.strcrc, b, null_terminate=True)
+    # Every string contributes its decrypted bytes and a terminating null, so a batch is checked in one pass. crc
+    # defaults to the CRC of the string table being loaded.
+    def _crc(self, strings, crc=None):
+        if len(strings):
+            (self._string_crc if crc is None else crc).update(b'\x00'.join(strings), null_terminate=True)
 
-    def _stringgen(self, count):
+    # Yields (offset, length, key) of every encrypted string, reading only the length prefixes.
+    def _stringspans(self, count):
         while count > 0:
-            c = self.reader.seek(0, io.SEEK_CUR)
-            lb = self._uint16()
-            strlen = (lb ^ c) & 65535
-            lastread = strlen
-            while strlen == 65535:
+            c = self.offset
+            chunk = (self._uint16() ^ c) & 65535
+            strlen = chunk
+            # Lengths of 65535 and up continue into further words for as long as the last one read is 65535.
+            while chunk == 65535:
                 c += 2
-                lastread = self._uint16()
-                nextd = (lastread ^ c) & 65535
-                strlen += nextd
+                chunk = (self._uint16() ^ c) & 65535
+                strlen += chunk
             key = c + 2
             count -= 1
-            estr = self._nbytes(strlen)
-            string = RawString(bytearray(estr), key, lazy=True)
+            yield (self.offset, strlen, key)
+            self._ffwd(strlen)
+
+    # Checks the CRC that follows the table itself, with a CRC of its own, so a lazy load of the strings while it is
+    # suspended cannot disturb it.
+    def _stringgen(self, count):
+        crc = Byond32()
+        for offset, strlen, key in self._stringspans(count):
+            string = RawString(self.buffer[offset:offset + strlen], key, lazy=True)
             if self.check_string_crc:
-                self._crc(string.decrypt())
+                self._crc([string.decrypt()], crc)
             if self.string_mode == string_mode_byte_strings:
                 yield string.decrypt()
-            elif self.string_mode == string_mode_strings:
+            else:
                 yield string.decode()
             self._throttle()
+        if self.check_string_crc:
+            expected = self._uint32()
+            if expected != crc.digest():
+                raise DmbFileError("String table CRC mismatch (expected: {0}, got: {1})".format(expected, crc.digest()))
 
     def _datagen(self, count):
         while count > 0:
@@ -391,45 +947,35 @@ class Dmb:
             self._throttle()
 
     def _procgen(self, count):
+        layouts = self.layouts
         pid = 0
         while count > 0:
             ret = Proc()
             ret.id = pid
             pid += 1
-            ret.path = self._uarch()
-            ret.name = self._uarch()
-            ret.desc = self._uarch()
-            ret.category = self._uarch()
-            ret.range = self._uint8()
-            ret.access = self._uint8()
-            ret.flags = self._uint8()
+            ret.path, ret.name, ret.desc, ret.category, ret.range, ret.access, ret.flags = self._unpack(layouts.proc_head)
             if ret.flags & 0x80 > 0:
-                ret.ext_flags = self._uint32()
-                ret.invisibility = self._uint8()
-            ret.data = self._uarch()
-            ret.variable_list = self._uarch()
-            ret.argument_list = self._uarch()
+                ret.ext_flags, ret.invisibility = self._unpack(layouts.proc_ext)
+            ret.data, ret.variable_list, ret.argument_list = self._unpack(layouts.proc_tail)
             count -= 1
             yield ret
             self._throttle()
 
     def _vargen(self, count):
+        layout = self.layouts.value
         while count > 0:
             ret = Var()
-            typeid = self._uint8()
-            typeval = self._uint32()
-            ret.name = self._uarch()
+            typeid, typeval, ret.name = self._unpack(layout)
             ret.value = decode_value(typeid, typeval)
             count -= 1
             yield ret
             self._throttle()
 
     def _instancegen(self, count):
+        layout = self.layouts.value
         while count > 0:
             ret = Instance()
-            typeid = self._uint8()
-            typeval = self._uint32()
-            ret.initializer = self._uarch()
+            typeid, typeval, ret.initializer = self._unpack(layout)
             ret.value = decode_value(typeid, typeval)
             count -= 1
             yield ret
@@ -442,35 +988,72 @@ class Dmb:
             self._throttle()
 
     def _mappopgen(self, count):
+        layout = self.layouts.mappop
         while count > 0:
-            move = self._uint16()
-            instance = self._uarch()
             count -= 1
-            yield (move, instance)
+            yield self._unpack(layout)
             self._throttle()
 
     def _resourcegen(self, count):
+        layout = self.layouts.resource
         while count > 0:
-            rhash = self._uint32()
-            typeid = self._uint8()
+            rhash, typeid = self._unpack(layout)
             count -= 1
             yield Resource(typeid, rhash)
             self._throttle()
 
-    def _bytegen(self, delimiter):
-        eof = False
-        while not eof:
-            byte = self.reader.read(1)
-            if byte == b'':
-                eof = True
-                break
-            if byte == delimiter:
-                break
-            yield byte
-            self._throttle()
+    def _tilegen(self, count):
+        return TileGenerator(self, count).gen(count)
+
+    _record_generators = {
+        "tiles": _tilegen,
+        "types": _typegen,
+        "mobs": _mobgen,
+        "strings": _stringgen,
+        "data": _datagen,
+        "procs": _procgen,
+        "variables": _vargen,
+        "argprocs": _argprocgen,
+        "instances": _instancegen,
+        "mappops": _mappopgen,
+        "resources": _resourcegen,
+    }
+
+    # Yields (section, record) pairs in file order without keeping them: tiles one by one in x, y, z order (without
+    # their instances), map pops as (move, instance) pairs and the world data once. Records are parsed straight from the
+    # buffer; nothing is stored on the Dmb, so memory use does not grow with the file.
+    def iter_records(self, sections=None):
+        for name in sections or []:
+            if name not in section_order:
+                raise ValueError("Unknown dmb section: {0}".format(name))
+        for name, section in self.sections.items():
+            if sections is not None and name not in sections:
+                continue
+            if name == "world":
+                yield name, self.world
+                continue
+            if self._cache_entry is not None:
+                raise DmbFileError("Cannot read section {0}, the dmb was restored from the parse cache and has no file buffer; open it without cache_dir to stream records.".format(name))
+            if self.buffer is None:
+                raise DmbFileError("Cannot read section {0}, the dmb has already been closed.".format(name))
+            self.offset = section.offset
+            for record in self._record_generators[name](self, section.count):
+                yield name, record
 
     def _read_bytes_until(self, delimiter):
-        return b''.join([b for b in self._bytegen(delimiter)])
+        start = self.offset
+        end = start
+        length = len(self.buffer)
+        while end < length:
+            chunk = self.buffer[end:end + 64].tobytes()
+            found = chunk.find(delimiter)
+            if found != -1:
+                end += found
+                self.offset = end + len(delimiter)
+                return self.buffer[start:end].tobytes()
+            end += len(chunk)
+        self.offset = end
+        return self.buffer[start:end].tobytes()
 
     def _resolve_data(self, dataid):
         if dataid == 65535:
@@ -514,6 +1097,10 @@ class Dmb:
     def _resolve_string(self, stringid, mode=string_mode_default):
         if stringid == 0xFFFF:
             return None
+        if self.string_mode == string_mode_lazy:
+            if mode == string_mode_byte_strings:
+                return self.strings.bytes(stringid)
+            return self.strings.text(stringid)
         ret = self.strings[stringid]
         if isinstance(ret, RawString):
             val = ret.decrypt()
@@ -526,3 +1113,13 @@ class Dmb:
             elif dcmode == string_mode_byte_strings:
                 return RawString(ret, 0, mode=raw_string_mode_string).encode()
         return ret
+
+
+# Streams the records of a dmb without loading any section; see Dmb.iter_records.
+def iter_records(dmbname, sections=None, **kwargs):
+    dmb = Dmb(dmbname, sections=[], **kwargs)
+    try:
+        for record in dmb.iter_records(sections):
+            yield record
+    finally:
+        dmb.close()
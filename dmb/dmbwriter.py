@@ -1,19 +1,16 @@
 import struct
-from . import constants
-from .dmb import RawString, Type
-from .crypt import byond32
-
-try:
-    import numpy as np
-except:
-    from . import np_fallback as np
+from . import columnar, constants
+from .dmb import Type, encode_strings
+from .crypt import Byond32, crypt_string
+from .stats import Stats
 
 import io
 
 
 class DmbWriter:
-    def __init__(self, dmbname, dmb):
+    def __init__(self, dmbname, dmb, instrument=None):
         self.dmb = dmb
+        self.stats = Stats(instrument)
         self.writer = open(dmbname, 'wb')
 
     def __del__(self):
@@ -177,33 +174,34 @@ class DmbWriter:
                 self._uint8(t._unknown2)
                 if t._unknown2 > 0:
                     self._bytes(t._fdata4)
+            if self.dmb.world.min_client > 508:
+                use_color_matrix = getattr(t, "use_color_matrix", 0)
+                self._uint8(use_color_matrix)
+                if use_color_matrix > 0:
+                    self._bytes(t.color_matrix)
             self._uarch(t.builtin_variable_list)
 
     def _ffwd(self, count):
         return self.writer.seek(count, io.SEEK_CUR)
 
+    # 65535 words followed by the remainder, which is 0 for multiples of 65535; each word is xored with its offset.
     def _write_string_length(self, strlen):
         while strlen >= 65535:
-            s = (strlen ^ self._ffwd(0)) & 65535
+            s = (65535 ^ self._ffwd(0)) & 65535
             self._uint16(s)
             strlen -= 65535
         s = (strlen ^ self._ffwd(0)) & 65535
         self._uint16(s)
 
-    def _crc(self, b, curr):
-        return byond32(curr, b, null_terminate=True)
-
     def _write_strings(self):
-        strcrc = np.uint32(0xFFFFFFFF)
+        strcrc = Byond32()
         string_count = len(self.dmb.strings)
         self._uarch(string_count)
         for s in self.strings:
-            strcrc = self._crc(s, strcrc)
+            strcrc.update(s, null_terminate=True)
             self._write_string_length(len(s))
-            s = RawString(s, self._ffwd(0), mode=constants.raw_string_mode_decrypted, lazy=True)
-            data = s.encrypt(True)
-            self._bytes(data)
-        self._uint32(strcrc)
+            self._bytes(crypt_string(s, self._ffwd(0)))
+        self._uint32(strcrc.digest())
 
     def _write_mobs(self):
         mob_count = len(self.dmb.mobs)
@@ -227,7 +225,7 @@ class DmbWriter:
             self._bytes(data)
 
     def _write_procs(self):
-        proc_count = len(self.written_procs)
+        proc_count = len(self.dmb.procs)
         self._uarch(proc_count)
         for proc in self.dmb.procs:
             self._uarch(proc.path)
@@ -245,9 +243,9 @@ class DmbWriter:
             self._uarch(proc.argument_list)
 
     def _write_vars(self):
-        var_count = len(self.written_vars)
+        var_count = len(self.dmb.variables)
         self._uarch(var_count)
-        for var in self.dmb.vars:
+        for var in self.dmb.variables:
             self._uint8(var.value._typeid)
             self._uint32(var.value._value)
             self._uarch(var.name)
@@ -267,23 +265,40 @@ class DmbWriter:
             self._uarch(a)
 
     def _write_mappops(self):
-        total = 0
+        if isinstance(self.dmb.tiles, columnar.TileGrid):
+            return self._write_mappop_columns(self.dmb.tiles)
+        pops = []
+        # Instances are looked up by identity; the dict holds them, so no id is reused while it exists.
+        instance_ids = dict((inst, iid) for iid, inst in enumerate(self.dmb.instances))
         tid = 0
-        last_tid = 0
         for zlevel in self.dmb.tiles:
             for row in zlevel:
                 for tile in row:
-                    total += len(tile.instances)
-        self._uint32(total)
-        for zlevel in self.dmb.tiles:
-            for row in zlevel:
-                for tile in row:
-                    for inst in tile.instances:
-                        self._uint16(tid - last_tid)
-                        last_tid = tid
-                        iid = self.dmb.instances.index(inst)
-                        self._uarch(iid)
+                    for inst in tile._instances or ():
+                        if inst not in instance_ids:
+                            raise ValueError("Instance on tile {0} is not in the instance table.".format(tid))
+                        pops.append((tid, instance_ids[inst]))
                     tid += 1
+        return self._write_pops(pops)
+
+    # In columnar mode the map pops come straight from the grid's instance offsets and ids.
+    def _write_mappop_columns(self, grid):
+        np = columnar.np
+        linear = np.repeat(np.arange(grid.area.size, dtype=np.int64), np.diff(grid.instance_offsets))
+        return self._write_pops(zip(linear.tolist(), np.asarray(grid.instance_ids).tolist()))
+
+    # pops are (linear tile index, instance id) pairs in map order.
+    def _write_pops(self, pops):
+        pops = list(pops)
+        self._uint32(len(pops))
+        last_tid = 0
+        for tid, iid in pops:
+            if tid - last_tid > 65535:
+                raise ValueError("Gap of {0} tiles between map instances does not fit a map pop.".format(tid - last_tid))
+            self._uint16(tid - last_tid)
+            last_tid = tid
+            self._uarch(iid)
+        return len(pops)
 
     def _write_resources(self):
         res_count = len(self.dmb.resources)
@@ -327,32 +342,47 @@ class DmbWriter:
         self._uint16(self.dmb.world.icon_height)
         self._uint16(self.dmb.world.map_format)
 
+    # Runs write_section and records it as a phase; count defaults to what write_section returns.
+    def _section(self, name, write_section, count=None):
+        started = self.stats.start()
+        offset = self.writer.tell()
+        ret = write_section()
+        self.stats.record(name, started, ret if count is None else count, offset, self.writer.tell())
+
     def write(self):
+        started = self.stats.start()
         if self.dmb.string_mode == constants.string_mode_strings:
-            self.strings = [RawString(s, 0, mode=constants.raw_string_mode_string, lazy=True).encode() for s in self.dmb.strings]
+            self.strings = encode_strings(self.dmb.strings)
+        elif self.dmb.string_mode == constants.string_mode_lazy:
+            self.strings = list(self.dmb.strings.iter_bytes())
         else:
             self.strings = self.dmb.strings
         self.string_mem_len = 0
         for s in self.strings:
             self.string_mem_len += len(s) + 1
+        self.stats.record("encode strings", started, len(self.strings))
 
+        started = self.stats.start()
         self._write_version_data()
         self._uint32(self.dmb.flags)
         self._uint16(self.dmb.world.map_x)
         self._uint16(self.dmb.world.map_y)
         self._uint16(self.dmb.world.map_z)
-        self._write_tiles()
+        self.stats.record("header", started, offset=0, end=self.writer.tell())
+        self._section("tiles", self._write_tiles, self.dmb.world.map_x * self.dmb.world.map_y * self.dmb.world.map_z)
         self._uint32(self.string_mem_len)
 
-        self._write_types()
-        self._write_mobs()
-
-        self._write_strings()
-        self._write_data()
-        self._write_procs()
-        self._write_vars()
-        self._write_argprocs()
-        self._write_instances()
-        self._write_mappops()
-        self._write_extended_data()
-        self._write_resources()
+        self._section("types", self._write_types, len(self.dmb.types))
+        self._section("mobs", self._write_mobs, len(self.dmb.mobs))
+
+        self._section("strings", self._write_strings, len(self.strings))
+        self._section("data", self._write_data, len(self.dmb.data))
+        self._section("procs", self._write_procs, len(self.dmb.procs))
+        self._section("variables", self._write_vars, len(self.dmb.variables))
+        self._section("argprocs", self._write_argprocs, len(self.dmb.argprocs))
+        self._section("instances", self._write_instances, len(self.dmb.instances))
+        self._section("mappops", self._write_mappops)
+        self._section("world", self._write_extended_data, 1)
+        self._section("resources", self._write_resources, len(self.dmb.resources))
+        self.writer.close()
+        self.writer = None
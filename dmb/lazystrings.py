@@ -0,0 +1,105 @@
+from .dmb import decode_strings
+from .crypt import crypt_string
+import array
+import collections
+
+
+default_string_cache_size = 4096
+
+
+# The string table of a Dmb loaded with string_mode_lazy. Only the (offset, length, key) span of every encrypted string
+# is kept; a string is decrypted and decoded the first time it is asked for, and the decrypted bytes and decoded str
+# are kept for the max_size most recently used strings. Indexing and iterating give decoded strs, like the list of
+# string_mode_strings; bytes() gives the decrypted bytes with control codes left intact.
+class LazyStringTable:
+    def __init__(self, buffer, spans, max_size=default_string_cache_size):
+        self.buffer = buffer
+        self.offsets = array.array('L')
+        self.lengths = array.array('L')
+        self.keys = array.array('L')
+        for offset, length, key in spans:
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.keys.append(key)
+        self.max_size = max_size
+        self._cache = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.text(i) for i in range(*index.indices(len(self)))]
+        return self.text(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.text(i)
+
+    def iter_bytes(self):
+        for i in range(len(self)):
+            yield self.bytes(i)
+
+    def bytes(self, index):
+        return self._entry(index)[0]
+
+    def text(self, index):
+        entry = self._entry(index)
+        if entry[1] is None:
+            entry[1] = decode_strings([entry[0]])[0]
+        return entry[1]
+
+    # The [bytes, str] cache entry of a string, decrypting it on a miss and evicting the least recently used entry once
+    # the cache is over max_size.
+    def _entry(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("string index out of range")
+        entry = self._cache.get(index)
+        if entry is not None:
+            self._cache.move_to_end(index)
+            return entry
+        if self.buffer is None:
+            raise ValueError("String table is closed.")
+        offset = self.offsets[index]
+        entry = [bytes(crypt_string(self.buffer[offset:offset + self.lengths[index]], self.keys[index])), None]
+        if self.max_size > 0:
+            self._cache[index] = entry
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def close(self):
+        self.buffer = None
+        self._cache.clear()
+
+    def __repr__(self):
+        return "LazyStringTable({0} strings, {1} cached)".format(len(self), len(self._cache))
+
+    # A copy of the encrypted strings and their spans, with offsets rebased into the copy. The keys stay the original file
+    # offsets, which the cipher depends on.
+    def columns(self):
+        if self.buffer is None:
+            raise ValueError("String table is closed.")
+        start = min(self.offsets) if len(self) else 0
+        end = max(o + n for o, n in zip(self.offsets, self.lengths)) if len(self) else 0
+        offsets = array.array('L', (o - start for o in self.offsets))
+        return bytes(self.buffer[start:end]), offsets, self.lengths, self.keys
+
+    @classmethod
+    def from_columns(cls, buffer, offsets, lengths, keys, max_size=default_string_cache_size):
+        ret = cls.__new__(cls)
+        ret.buffer = memoryview(buffer)
+        ret.offsets = array.array('L', offsets)
+        ret.lengths = array.array('L', lengths)
+        ret.keys = array.array('L', keys)
+        ret.max_size = max_size
+        ret._cache = collections.OrderedDict()
+        return ret
+
+    def __reduce__(self):
+        return (type(self).from_columns, self.columns() + (self.max_size,))
@@ -0,0 +1,157 @@
+import sys
+import time
+import tracemalloc
+
+
+# One timed phase of a load, tree build or write: the number of records handled and, for file sections, the byte range
+# [offset, end). When memory is profiled, retained is the traced memory the phase added and left alive and blocks the
+# change in allocated memory blocks, roughly the number of objects it created and kept.
+class PhaseStats:
+    def __init__(self, name, count=None, offset=None, end=None, seconds=0.0, retained=None, blocks=None):
+        self.name = name
+        self.count = count
+        self.offset = offset
+        self.end = end
+        self.seconds = seconds
+        self.retained = retained
+        self.blocks = blocks
+
+    @property
+    def size(self):
+        if self.offset is None or self.end is None:
+            return None
+        return self.end - self.offset
+
+    @property
+    def records_per_second(self):
+        if self.count is None or self.seconds <= 0:
+            return None
+        return self.count / self.seconds
+
+    @property
+    def bytes_per_second(self):
+        if self.size is None or self.seconds <= 0:
+            return None
+        return self.size / self.seconds
+
+    def __repr__(self):
+        return "PhaseStats({0}, count={1}, size={2}, seconds={3:.6f})".format(self.name, self.count, self.size, self.seconds)
+
+    def __json__(self):
+        return {
+            "name": self.name,
+            "count": self.count,
+            "offset": self.offset,
+            "end": self.end,
+            "seconds": self.seconds,
+            "records_per_second": self.records_per_second,
+            "bytes_per_second": self.bytes_per_second,
+            "retained": self.retained,
+            "blocks": self.blocks,
+        }
+
+
+# The phases recorded for one Dmb, ObjectTree or DmbWriter, in the order they finished. callback, if given, is called
+# with every PhaseStats as soon as it is recorded, e.g. to forward it to a metrics pipeline.
+#
+# With profile_memory, traced memory and allocated blocks are read before and after every phase. tracemalloc is started
+# if it is not running and left running for later lazy loads; tracing slows allocation down, so times are not
+# comparable to unprofiled runs.
+class Stats:
+    def __init__(self, callback=None, profile_memory=False):
+        self.phases = []
+        self.callback = callback
+        self.profile_memory = profile_memory
+        self._open = []
+
+    # Phases may nest, e.g. a lazy section loaded while the map is being populated. Every open phase keeps the totals of
+    # the phases recorded inside it, [seconds, retained, blocks], and leaves them out of its own, so each phase counts
+    # only its own work and the phases of a Stats add up to the whole.
+    def start(self):
+        if self.profile_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            started = [tracemalloc.get_traced_memory()[0], sys.getallocatedblocks(), time.perf_counter(), 0.0, 0, 0]
+        else:
+            started = [None, None, time.perf_counter(), 0.0, 0, 0]
+        self._open.append(started)
+        return started
+
+    def record(self, name, started, count=None, offset=None, end=None):
+        seconds = time.perf_counter() - started[2]
+        retained = blocks = None
+        if self.profile_memory:
+            retained = tracemalloc.get_traced_memory()[0] - started[0]
+            blocks = sys.getallocatedblocks() - started[1]
+        # Phases opened after this one and never recorded were abandoned by an exception.
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i] is started:
+                del self._open[i:]
+                break
+        if self._open:
+            outer = self._open[-1]
+            outer[3] += seconds
+            if retained is not None:
+                outer[4] += retained
+                outer[5] += blocks
+        seconds -= started[3]
+        if retained is not None:
+            retained -= started[4]
+            blocks -= started[5]
+        phase = PhaseStats(name, count, offset, end, seconds, retained, blocks)
+        self.phases.append(phase)
+        if self.callback is not None:
+            self.callback(phase)
+        return phase
+
+    # The last phase recorded under name.
+    def __getitem__(self, name):
+        for phase in reversed(self.phases):
+            if phase.name == name:
+                return phase
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(phase.name == name for phase in self.phases)
+
+    def __iter__(self):
+        return iter(self.phases)
+
+    def __len__(self):
+        return len(self.phases)
+
+    @property
+    def seconds(self):
+        return sum(phase.seconds for phase in self.phases)
+
+    def report(self):
+        lines = []
+        for phase in self.phases:
+            line = "{0:<16} {1:10.4f} s".format(phase.name, phase.seconds)
+            if phase.count is not None:
+                line += " {0:>10} records".format(phase.count)
+                if phase.records_per_second is not None:
+                    line += " {0:>12.0f}/s".format(phase.records_per_second)
+            if phase.size is not None:
+                line += " {0:>12} bytes".format(phase.size)
+                if phase.bytes_per_second is not None:
+                    line += " {0:>8.1f} MiB/s".format(phase.bytes_per_second / 1048576)
+            lines.append(line)
+        return "\n".join(lines)
+
+    # Phases by retained memory, largest first.
+    def memory_report(self):
+        lines = []
+        total = sum(phase.retained for phase in self.phases if phase.retained is not None)
+        for phase in sorted((phase for phase in self.phases if phase.retained is not None), key=lambda phase: -phase.retained):
+            share = 100.0 * phase.retained / total if total > 0 else 0.0
+            lines.append("{0:<16} {1:12.1f} KiB {2:5.1f}% {3:>10} blocks".format(phase.name, phase.retained / 1024, share, phase.blocks))
+        lines.append("{0:<16} {1:12.1f} KiB".format("total", total / 1024))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "Stats({0} phases, {1:.6f} s)".format(len(self.phases), self.seconds)
+
+    def __json__(self):
+        return self.phases
+
@@ -0,0 +1,235 @@
+from .dmb import Tile, Mob, Proc, WorldData, Var, Instance, Resource, Type
+from .dmbreader import Dmb
+from .value import decode_value
+from .constants import string_mode_byte_strings
+import random
+import struct
+
+
+base_types = [
+    ("/datum", None),
+    ("/atom", "/datum"),
+    ("/atom/movable", "/atom"),
+    ("/area", "/atom"),
+    ("/turf", "/atom"),
+    ("/obj", "/atom/movable"),
+    ("/mob", "/atom/movable"),
+]
+
+# Scales for synthetic_dmb, from a quick smoke test to a large world.
+presets = {
+    "small": dict(map_x=32, map_y=32, map_z=1, types=100, procs=200, variables=1000, strings=1000, instances=200),
+    "medium": dict(map_x=255, map_y=255, map_z=2, types=2000, procs=5000, variables=30000, strings=30000, instances=5000),
+    "large": dict(map_x=500, map_y=500, map_z=6, types=10000, procs=40000, variables=200000, strings=150000, instances=40000),
+}
+
+
+# Builds an in-memory Dmb with made-up but consistent contents: every id points at an existing record, types form a
+# tree under the built-in types and procs are defined on existing types, so the result can be written with DmbWriter,
+# read back and turned into an ObjectTree. run_length is the average length of a run of identical tiles and
+# instance_density the share of tiles that hold instances. Counts below what the structure needs are raised to it.
+def synthetic_dmb(map_x=32, map_y=32, map_z=1, run_length=8, types=100, procs=200, variables=1000, strings=1000, instances=200, instance_density=0.05, bit32=False, min_client=510, seed=0):
+    rand = random.Random(seed)
+    arch = "<I" if bit32 else "<H"
+    null = 0xFFFF
+
+    dmb = Dmb.__new__(Dmb)
+    dmb.string_mode = string_mode_byte_strings
+    dmb.bit32 = bit32
+    dmb.flags = 0x40000000 if bit32 else 0
+    dmb.strings = []
+    dmb.data = []
+    dmb.types = []
+    dmb.procs = []
+    dmb.variables = []
+    dmb.instances = []
+    dmb.mobs = []
+    dmb.resources = []
+    dmb.argprocs = []
+
+    # Id 0xFFFF reads back as null, so in 32-bit worlds that slot is filled with a record nothing refers to.
+    def string(value):
+        if len(dmb.strings) == null:
+            dmb.strings.append(bytearray())
+        dmb.strings.append(bytearray(value))
+        return len(dmb.strings) - 1
+
+    def data(ids):
+        if not ids:
+            return null
+        if len(dmb.data) == null:
+            dmb.data.append(b'')
+        dmb.data.append(struct.pack(arch[0] + arch[1] * len(ids), *ids))
+        return len(dmb.data) - 1
+
+    for i in range(max(4, types // 20)):
+        dmb.resources.append(Resource(rand.choice([1, 2, 3]), rand.getrandbits(32)))
+
+    var_names = [string(b"var%d" % i) for i in range(max(1, variables // 10))]
+    for i in range(max(1, variables)):
+        ret = Var()
+        ret.name = rand.choice(var_names)
+        kind = rand.random()
+        if kind < 0.3:
+            ret.value = decode_value(42, struct.unpack("<I", struct.pack("<f", rand.randrange(1000) / 4))[0])
+        elif kind < 0.6:
+            ret.value = decode_value(6, string(b"value %d" % i))
+        else:
+            ret.value = decode_value(0, 0)
+        dmb.variables.append(ret)
+
+    # Types: the built-in ones first, then random subtypes of already defined types.
+    paths = []
+    parents = {}
+    for path, parent in base_types:
+        parents[path] = parent
+        paths.append(path)
+    for i in range(max(0, types - len(base_types))):
+        parent = rand.choice(paths[1:])
+        paths.append("{0}/t{1}".format(parent, i))
+        parents[paths[-1]] = parent
+    type_ids = dict((path, i) for i, path in enumerate(paths))
+
+    # Procs, defined on random types; verbs only on atoms.
+    procs_on = dict((path, ([], [])) for path in paths)
+    for i in range(max(1, procs)):
+        owner = rand.choice(paths)
+        verb = owner.startswith(("/atom", "/area", "/turf", "/obj", "/mob")) and rand.random() < 0.2
+        ret = Proc()
+        ret.id = i
+        ret.path = string("{0}/{1}/{2}{3}".format(owner, "verb" if verb else "proc", "v" if verb else "p", i).encode('ascii'))
+        ret.name = string(b"p%d" % i) if verb else null
+        ret.desc = null
+        ret.category = null
+        ret.range = 0
+        ret.access = 0
+        ret.flags = rand.choice([0, 0, 0x80])
+        if ret.flags & 0x80:
+            ret.ext_flags = rand.getrandbits(8)
+            ret.invisibility = rand.randrange(100)
+        ret.data = data([rand.getrandbits(16) for j in range(rand.randrange(4, 64))])
+        ret.variable_list = data([rand.randrange(len(dmb.variables)) for j in range(rand.randrange(0, 4))])
+        args = []
+        for j in range(rand.randrange(0, 3)):
+            args += [rand.choice([0, 1, 4, 8]), rand.choice([1, 2, 8, 16]) | (rand.choice([125, 5]) << 8), rand.randrange(len(dmb.variables)), 0]
+        ret.argument_list = data(args)
+        dmb.procs.append(ret)
+        procs_on[owner][1 if verb else 0].append(i)
+    dmb.argprocs = [rand.randrange(len(dmb.procs)) for i in range(4)]
+
+    for i, path in enumerate(paths):
+        ret = Type(string(path.encode('ascii')), null if parents[path] is None else type_ids[parents[path]])
+        ret.id = i
+        ret.name = string(path.rsplit("/", 1)[1].encode('ascii'))
+        ret.desc = null
+        ret.icon = rand.randrange(len(dmb.resources)) if rand.random() < 0.5 else null
+        ret.icon_state = null
+        ret.dir = 2
+        ret.text = null
+        ret.suffix = null
+        ret.maptext = null
+        ret.maptext_width = 32
+        ret.maptext_height = 32
+        ret.layer = float(rand.randrange(1, 5))
+        ret._unknown1 = 15 if rand.random() < 0.1 else 0
+        if ret._unknown1 == 15:
+            ret._fdata1 = bytes(rand.getrandbits(8) for j in range(4))
+        ret._unknown2 = 1 if rand.random() < 0.1 else 0
+        if ret._unknown2:
+            ret._fdata4 = bytes(rand.getrandbits(8) for j in range(24))
+        ret.use_color_matrix = 1 if rand.random() < 0.05 else 0
+        if ret.use_color_matrix:
+            ret.color_matrix = struct.pack("<20f", *[1.0 if j % 6 == 0 else 0.0 for j in range(20)])
+        own_vars = []
+        for j in range(rand.randrange(0, 6)):
+            own_vars += [rand.randrange(len(dmb.variables)), 0]
+        ret.variable_list = data(own_vars)
+        ret.proc_list = data(procs_on[path][0])
+        ret.verb_list = data(procs_on[path][1])
+        ret._unknown3 = null
+        ret._unknown4 = null
+        ret.builtin_variable_list = null
+        dmb.types.append(ret)
+
+    for i in range(3):
+        mob = Mob()
+        mob._fdata1 = bytes(rand.getrandbits(8) for j in range(8 if bit32 else 4))
+        mob._unknown = rand.choice([0, 0x80])
+        if mob._unknown & 0x80:
+            mob._fdata2 = bytes(rand.getrandbits(8) for j in range(6))
+        dmb.mobs.append(mob)
+
+    for i in range(max(1, instances)):
+        ret = Instance()
+        ret.value = decode_value(32, rand.randrange(len(dmb.types)))
+        ret.initializer = null
+        dmb.instances.append(ret)
+
+    # Tiles in runs of random length around run_length, every run an (area, turf) pair.
+    areas = [type_ids[path] for path in paths if path.startswith("/area")]
+    turfs = [type_ids[path] for path in paths if path.startswith("/turf")]
+    dmb.tiles = []
+    remaining = 0
+    since_instance = 0
+    for z in range(map_z):
+        level = []
+        for y in range(map_y):
+            row = []
+            for x in range(map_x):
+                if remaining == 0:
+                    remaining = rand.randrange(1, max(2, 2 * run_length))
+                    area, turf = rand.choice(areas), rand.choice(turfs)
+                remaining -= 1
+                tile = Tile(area, turf, 0)
+                since_instance += 1
+                # Map pops can only skip 65535 tiles, so a long empty stretch gets an instance anyway.
+                if rand.random() < instance_density or since_instance >= 65535:
+                    tile.instances = [rand.choice(dmb.instances) for j in range(rand.randrange(1, 3))]
+                    since_instance = 0
+                row.append(tile)
+            level.append(row)
+        dmb.tiles.append(level)
+
+    world = WorldData()
+    world.world_version = 512
+    world.min_server = min_client
+    world.min_client = min_client
+    world.map_x, world.map_y, world.map_z = map_x, map_y, map_z
+    world.default_mob = type_ids["/mob"]
+    world.default_turf = type_ids["/turf"]
+    world.default_area = type_ids["/area"]
+    world.world_procs = null
+    world.global_init = null
+    world.world_domain = null
+    world.world_name = string(b"Synthetic World")
+    world.tick_lag = 1
+    world.client_type = null
+    world.image_type = null
+    world.client_script = null
+    world.view_width = 15
+    world.view_height = 15
+    world.hub_password = null
+    world.world_status = null
+    world.cache_lifespan = 30
+    world.default_command_text = null
+    world.default_command_prompt = null
+    world.hub_path = null
+    world.unknown6 = null
+    world.unknown7 = null
+    world.icon_width = 32
+    world.icon_height = 32
+    dmb.world = world
+
+    while len(dmb.strings) < strings:
+        string(bytes(rand.randrange(32, 127) for j in range(rand.randrange(1, 40))))
+    if not bit32:
+        for name in ["strings", "data", "types", "procs", "variables", "instances"]:
+            if len(getattr(dmb, name)) >= null:
+                raise ValueError("{0} {1} do not fit in a 16-bit dmb.".format(len(getattr(dmb, name)), name))
+    return dmb
+
+
+def write_synthetic(dmbname, **kwargs):
+    dmb = synthetic_dmb(**kwargs)
+    dmb.write(dmbname)
+    return dmb
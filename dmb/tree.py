@@ -1,6 +1,7 @@
 from .dmb import Type, Proc, Arg
 from . import json as dmbjson
 from . import constants
+from .stats import Stats
 import json
 import struct
 
@@ -70,22 +71,36 @@ def base_type_vars(path):
 
 
 class ObjectTree:
-    def __init__(self, tree={}, dmb=None, loaded=False, procref=None):
+    def __init__(self, tree={}, dmb=None, loaded=False, procref=None, instrument=None, profile_memory=False):
         if dmb is not None and dmb.string_mode == constants.string_mode_byte_strings:
             raise TypeError("ObjectTrees cannot be used with undecoded strings.")
         self.tree = tree
+        self.stats = Stats(instrument, profile_memory)
         if procref is not None:
             self._resolve_proc_references_recursive(self.tree, self.procref)
 
         if loaded and tree != {}:
+            started = self.stats.start()
             self._resolve_tree_recursive(self.tree)
+            self.stats.record("resolve", started)
         if dmb is not None:
+            # Lazy sections are loaded up front so their cost lands in dmb.stats rather than inside the tree's phases.
+            for name in ("types", "strings", "data", "resources", "variables", "procs", "argprocs"):
+                getattr(dmb, name)
+            started = self.stats.start()
             self._populate_types_from_dmb(dmb)
+            self.stats.record("types", started, len(dmb.types))
         if loaded or dmb is not None:
+            started = self.stats.start()
             self._resolve_parents_recursive(self.tree)
+            self.stats.record("parents", started)
         if dmb is not None:
+            started = self.stats.start()
             self._populate_variables_recursive(self.tree, dmb)
+            self.stats.record("variables", started, len(dmb.types))
+            started = self.stats.start()
             self._assign_procedures(dmb)
+            self.stats.record("procedures", started, len(dmb.procs))
 
     def _populate_types_from_dmb(self, dmb):
         for t in dmb.types:
@@ -349,6 +364,10 @@ class ObjectTree:
     def _aggregate_procedures(self):
         return self._aggregate_procedures_recursive(self.tree)
 
+    # Prints the memory retained by every build phase; needs profile_memory.
+    def memory_report(self):
+        print(self.stats.memory_report())
+
     def json(self):
         return json.dumps({"tree": self.tree, "procs": self._aggregate_procedures()}, cls=dmbjson.JSONEncoder, sort_keys=True, indent=2)
 
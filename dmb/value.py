@@ -1,86 +1,122 @@
+import struct
+
+
+bits_layout = struct.Struct("<I")
+float_layout = struct.Struct("<f")
+
+
 class compiled_value():
+    __slots__ = ("_typeid", "_value")
+
     def __init__(self, typeid, value):
         self._typeid = typeid
         self._value = value
 
 
 class value_null(compiled_value):
-    pass
+    __slots__ = ()
 
 
 class value_mob(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_resource(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_type(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_savefile_type(compiled_value):
+    __slots__ = ()
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         pass
 
 
 class value_file_type(compiled_value):
+    __slots__ = ()
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         pass
 
 
 class value_list_type(compiled_value):
+    __slots__ = ()
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         pass
 
 
 class value_client_type(compiled_value):
+    __slots__ = ()
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         pass
 
 
 class value_string(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
+# Numbers are stored as the bits of a 32-bit float; value is the float, _value the raw bits.
 class value_number(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
-        self.value = value
+        self.value = float_layout.unpack(bits_layout.pack(value))[0]
 
 
 class value_list(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_proc(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_image(compiled_value):
+    __slots__ = ("value",)
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.value = value
 
 
 class value_unknown(compiled_value):
+    __slots__ = ("typeid", "value")
+
     def __init__(self, typeid, value):
         super().__init__(typeid, value)
         self.typeid = typeid
@@ -106,8 +142,41 @@ decode_map = {
 }
 
 
+# Decoded values are shared between the records that hold the same (typeid, value) pair, so they must be treated as
+# immutable: build a new value instead of changing one in place.
+null_value = value_null(0, 0)
+
+
 def decode_value(typeid, value):
-    global decode_map
-    if typeid in decode_map:
-        return decode_map[typeid](typeid, value)
-    return value_unknown(typeid, value)
+    if typeid == 0 and value == 0:
+        return null_value
+    return decode_map.get(typeid, value_unknown)(typeid, value)
+
+
+def new_value_cache():
+    return {(0, 0): null_value}
+
+
+# Decodes one (typeid, value) pair through cache, which maps pairs to the values already decoded.
+def intern_value(typeid, value, cache):
+    pair = (typeid, value)
+    ret = cache.get(pair)
+    if ret is None:
+        ret = cache[pair] = decode_map.get(typeid, value_unknown)(typeid, value)
+    return ret
+
+
+# Decodes a whole section's (typeid, value) pairs at once, decoding every distinct pair only once. cache maps pairs to
+# values and may be shared between sections.
+def decode_values(pairs, cache=None):
+    if cache is None:
+        cache = new_value_cache()
+    ret = []
+    append = ret.append
+    get = cache.get
+    for pair in pairs:
+        value = get(pair)
+        if value is None:
+            value = cache[pair] = decode_map.get(pair[0], value_unknown)(*pair)
+        append(value)
+    return ret
@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, string_mode_strings
+from dmb.cache import ParseCache
+from dmb.synthetic import synthetic_dmb
+
+
+# A warm load must give the same tables as parsing the file, and a broken entry must be treated as a miss.
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dmbname = os.path.join(self.directory, "world.dmb")
+        self.cache_dir = os.path.join(self.directory, "cache")
+        synthetic_dmb(map_z=2, min_client=510).write(self.dmbname)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        return [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".dmbcache")]
+
+    def test_warm_load(self):
+        for string_mode in (string_mode_strings, None):
+            kwargs = {} if string_mode is None else {"string_mode": string_mode}
+            with self.subTest(**kwargs):
+                parsed = Dmb(self.dmbname, **kwargs)
+                Dmb(self.dmbname, cache_dir=self.cache_dir, **kwargs)
+                warm = Dmb(self.dmbname, cache_dir=self.cache_dir, throttle=True, **kwargs)
+                self.assertIn("cache load", warm.stats)
+                self.assertNotIn("open", warm.stats)
+                self.assertTrue(warm.throttle)
+                self.assertEqual(list(warm.strings), list(parsed.strings))
+                self.assertEqual(list(warm.data), list(parsed.data))
+                self.assertEqual([(t.path, t.parent, t.layer, t.variable_list) for t in warm.types], [(t.path, t.parent, t.layer, t.variable_list) for t in parsed.types])
+                self.assertEqual([(v.name, type(v.value), v.value._value) for v in warm.variables], [(v.name, type(v.value), v.value._value) for v in parsed.variables])
+                self.assertEqual(self.placements(warm), self.placements(parsed))
+                warm.write(os.path.join(self.directory, "warm.dmb"))
+                parsed.write(os.path.join(self.directory, "parsed.dmb"))
+                with open(os.path.join(self.directory, "warm.dmb"), "rb") as a, open(os.path.join(self.directory, "parsed.dmb"), "rb") as b:
+                    self.assertEqual(a.read(), b.read())
+
+    def placements(self, dmb):
+        instances = dict((id(instance), i) for i, instance in enumerate(dmb.instances))
+        return [(tile.area, tile.turf, [instances[id(instance)] for instance in tile.instances]) for level in dmb.tiles for row in level for tile in row]
+
+    def test_broken_entry_is_a_miss(self):
+        Dmb(self.dmbname, cache_dir=self.cache_dir)
+        for path in self.entries():
+            with open(path, "r+b") as f:
+                f.truncate(os.path.getsize(path) // 2)
+        dmb = Dmb(self.dmbname, cache_dir=self.cache_dir)
+        self.assertIn("open", dmb.stats)
+        self.assertEqual(len(dmb.types), len(Dmb(self.dmbname).types))
+        self.assertIn("cache load", Dmb(self.dmbname, cache_dir=self.cache_dir).stats)
+
+    def test_eviction_covers_pointers(self):
+        for i in range(4):
+            synthetic_dmb(map_z=1, seed=i).write(self.dmbname)
+            os.utime(self.dmbname, ns=(i * 10 ** 9, i * 10 ** 9))
+            Dmb(self.dmbname, cache_dir=self.cache_dir, cache_size=1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        Dmb(self.dmbname, cache_dir=self.cache_dir)
+        self.assertEqual(sorted(os.path.splitext(name)[1] for name in os.listdir(self.cache_dir)), [".dmbcache", ".key"])
+
+    def test_failed_write_leaves_no_temp_file(self):
+        cache = ParseCache(self.cache_dir)
+        with self.assertRaises(TypeError):
+            cache.store("broken", object())
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
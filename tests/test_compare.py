@@ -0,0 +1,64 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import dmb
+from dmb import diff
+from dmb.synthetic import synthetic_dmb
+from dmb.value import decode_value
+
+
+# Two builds of the same synthetic world, the second with one var, one type and one string changed.
+class DiffTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.a = os.path.join(self.directory, "a.dmb")
+        self.b = os.path.join(self.directory, "b.dmb")
+        synthetic_dmb(seed=5).write(self.a)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_identical(self):
+        synthetic_dmb(seed=5).write(self.b)
+        result = diff(self.a, self.b)
+        self.assertFalse(result)
+        self.assertIn("types", result.unchanged_sections)
+        self.assertIn("strings", result.unchanged_sections)
+
+    def test_changes(self):
+        source = synthetic_dmb(seed=5)
+        paths = [bytes(source.strings[t.path]).decode('ascii') for t in source.types]
+        var_lists = [struct.unpack("<%dH" % (len(source.data[t.variable_list]) // 2), source.data[t.variable_list]) if t.variable_list != 0xFFFF else () for t in source.types]
+
+        varid = next(ids for ids in var_lists if ids)[0]
+        source.variables[varid].value = decode_value(42, struct.unpack("<I", struct.pack("<f", 12345.5))[0])
+        changed_type = 10
+        source.types[changed_type].layer += 1
+        old_string = bytes(source.strings[-1])
+        source.strings[-1] = bytearray(b"a string that was not there before")
+        source.write(self.b)
+
+        result = diff(self.a, self.b)
+        self.assertEqual(result.strings.added, [b"a string that was not there before"])
+        self.assertEqual(result.strings.removed, [old_string])
+        expected = set(paths[i] for i, ids in enumerate(var_lists) if varid in ids[0::2])
+        expected.add(paths[changed_type])
+        self.assertEqual(sorted(result.types.changed), sorted(expected))
+        self.assertEqual(result.types.added, [])
+        self.assertEqual(result.types.removed, [])
+        self.assertFalse(result.procs)
+        self.assertEqual(result.world.changed, {})
+
+    def test_namespace(self):
+        self.assertIs(dmb.diff, diff)
+        self.assertFalse(hasattr(dmb, "hashlib"))
+
+
+if __name__ == "__main__":
+    unittest.main()
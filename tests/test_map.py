@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb
+from dmb import columnar
+from dmb.synthetic import synthetic_dmb
+
+np = columnar.np
+
+
+# Region and coordinate queries on a columnar Dmb must agree with the nested tile lists of an object-mode Dmb.
+@unittest.skipIf(np is None, "columnar mode requires numpy")
+class MapQueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.dmbname = os.path.join(cls.directory, "world.dmb")
+        synthetic_dmb(map_x=40, map_y=30, map_z=2, instance_density=0.3, seed=11).write(cls.dmbname)
+        cls.nested = Dmb(cls.dmbname)
+        cls.grid = Dmb(cls.dmbname, columnar=True)
+        cls.instance_ids = dict((id(instance), i) for i, instance in enumerate(cls.nested.instances))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    regions = [(0, 0, 0, 40, 30), (1, 5, 7, 13, 9), (1, 39, 29, 40, 30), (0, 3, 4, 3, 10), (0, 10, 10, 10, 10)]
+
+    def test_region(self):
+        for z, x0, y0, x1, y1 in self.regions:
+            with self.subTest(region=(z, x0, y0, x1, y1)):
+                region = self.grid.region(z, x0, y0, x1, y1)
+                rows = [self.nested.tiles[z][y][x0:x1] for y in range(y0, y1)]
+                self.assertEqual(region.instance_counts().tolist(), [[len(tile.instances) for tile in row] for row in rows])
+                self.assertEqual(region.area.tolist(), [[tile.area for tile in row] for row in rows])
+                self.assertEqual(region.turf.tolist(), [[tile.turf for tile in row] for row in rows])
+                expected = [self.instance_ids[id(instance)] for row in rows for tile in row for instance in tile.instances]
+                self.assertEqual(region.instance_ids().tolist(), expected)
+
+    def test_region_out_of_range(self):
+        for bounds in [(2, 0, 0, 1, 1), (0, -1, 0, 1, 1), (0, 0, 0, 41, 1), (0, 0, 0, 1, 31), (0, 5, 0, 4, 1)]:
+            with self.subTest(bounds=bounds):
+                with self.assertRaises(IndexError):
+                    self.grid.region(*bounds)
+
+    def test_tiles_at(self):
+        coords = [(0, 0, 0), (39, 29, 1), (12, 7, 1), (12, 7, 1), (5, 20, 0)]
+        area, turf, unknown = self.grid.tiles_at(coords)
+        tiles = [self.nested.tiles[z][y][x] for x, y, z in coords]
+        self.assertEqual(area.tolist(), [tile.area for tile in tiles])
+        self.assertEqual(turf.tolist(), [tile.turf for tile in tiles])
+        self.assertEqual(unknown.tolist(), [tile.unknown for tile in tiles])
+        self.assertEqual([len(a) for a in self.grid.tiles_at(np.zeros((0, 3)))], [0, 0, 0])
+        for coord in [(40, 0, 0), (0, 30, 0), (0, 0, 2), (-1, 0, 0)]:
+            with self.subTest(coord=coord):
+                with self.assertRaises(IndexError):
+                    self.grid.tiles_at([coord])
+
+    def test_needs_columnar(self):
+        with self.assertRaises(TypeError):
+            self.nested.region(0, 0, 0, 1, 1)
+        with self.assertRaises(TypeError):
+            self.nested.tiles_at([(0, 0, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
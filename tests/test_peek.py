@@ -0,0 +1,51 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, DmbFileError
+from dmb.synthetic import synthetic_dmb
+
+
+# peek must report what a full load reads from the header, without reading further.
+class PeekTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dmbname = os.path.join(self.directory, "world.dmb")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_header(self):
+        for bit32 in (False, True):
+            for min_client in (499, 510):
+                with self.subTest(bit32=bit32, min_client=min_client):
+                    synthetic_dmb(map_x=20, map_y=12, map_z=3, bit32=bit32, min_client=min_client).write(self.dmbname)
+                    header = Dmb.peek(self.dmbname)
+                    loaded = Dmb(self.dmbname, sections=[])
+                    self.assertEqual(header.bit32, bit32)
+                    self.assertEqual(header.flags, loaded.flags)
+                    self.assertEqual((header.world.world_version, header.world.min_server, header.world.min_client), (512, min_client, min_client))
+                    self.assertEqual((header.world.map_x, header.world.map_y, header.world.map_z), (20, 12, 3))
+                    self.assertIsNone(header.sections)
+
+    def test_extended(self):
+        synthetic_dmb(map_z=2).write(self.dmbname)
+        header = Dmb.peek(self.dmbname, extended=True)
+        loaded = Dmb(self.dmbname, sections=[])
+        self.assertEqual([(s.name, s.offset, s.count, s.end) for s in header.sections.values()], [(s.name, s.offset, s.count, s.end) for s in loaded.sections.values()])
+        self.assertEqual(header.world.world_name, loaded.world.world_name)
+        self.assertEqual(header.world.default_mob, loaded.world.default_mob)
+
+    def test_not_a_dmb(self):
+        with open(self.dmbname, "wb") as f:
+            f.write(b"not a dmb\n")
+        with self.assertRaises(DmbFileError):
+            Dmb.peek(self.dmbname)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, DmbFileError, iter_records, string_mode_byte_strings, string_mode_strings
+from dmb.synthetic import synthetic_dmb
+
+
+# Streamed records must match what a full load gives, and the streamed string table checks its own CRC.
+class IterRecordsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dmbname = os.path.join(self.directory, "world.dmb")
+        synthetic_dmb(map_z=2, seed=7).write(self.dmbname)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def records(self, dmb, name):
+        return [record for section, record in dmb.iter_records([name])]
+
+    def test_matches_load(self):
+        for string_mode in (string_mode_strings, string_mode_byte_strings):
+            with self.subTest(string_mode=string_mode):
+                loaded = Dmb(self.dmbname, string_mode=string_mode)
+                streamed = Dmb(self.dmbname, sections=[], string_mode=string_mode, check_string_crc=True)
+                self.assertEqual(self.records(streamed, "strings"), list(loaded.strings))
+                self.assertEqual(self.records(streamed, "data"), list(loaded.data))
+                self.assertEqual([t.path for t in self.records(streamed, "types")], [t.path for t in loaded.types])
+                self.assertEqual([v.value._value for v in self.records(streamed, "variables")], [v.value._value for v in loaded.variables])
+                tiles = [(tile.area, tile.turf) for level in loaded.tiles for row in level for tile in row]
+                self.assertEqual([(tile.area, tile.turf) for tile in self.records(streamed, "tiles")], tiles)
+                self.assertEqual(self.records(streamed, "world")[0].map_z, 2)
+        names = [name for name, record in iter_records(self.dmbname)]
+        self.assertEqual(sorted(set(names)), sorted(Dmb(self.dmbname, sections=[]).sections))
+        with self.assertRaises(ValueError):
+            list(iter_records(self.dmbname, ["nope"]))
+
+    def test_lazy_load_while_streaming_strings(self):
+        dmb = Dmb(self.dmbname, sections=[], check_string_crc=True)
+        streamed = []
+        for name, record in dmb.iter_records(["strings"]):
+            if not streamed:
+                dmb.strings
+            streamed.append(record)
+        self.assertEqual(streamed, list(dmb.strings))
+
+    def test_string_crc_mismatch(self):
+        end = Dmb(self.dmbname, sections=[]).sections["strings"].end
+        with open(self.dmbname, "r+b") as f:
+            f.seek(end - 1)
+            last = f.read(1)
+            f.seek(end - 1)
+            f.write(bytes([last[0] ^ 0xFF]))
+        self.assertEqual(len(list(iter_records(self.dmbname, ["strings"]))), len(Dmb(self.dmbname).strings))
+        with self.assertRaises(DmbFileError):
+            list(iter_records(self.dmbname, ["strings"], check_string_crc=True))
+
+    def test_restored_from_cache(self):
+        cache_dir = os.path.join(self.directory, "cache")
+        Dmb(self.dmbname, cache_dir=cache_dir)
+        dmb = Dmb(self.dmbname, cache_dir=cache_dir)
+        self.assertIn("cache load", dmb.stats)
+        with self.assertRaisesRegex(DmbFileError, "parse cache"):
+            list(dmb.iter_records(["types"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, ObjectTree, string_mode_strings
+from dmb.synthetic import synthetic_dmb
+from dmb import columnar
+
+
+# Lengths around the points where a string length spills into further 16-bit words.
+long_string_lengths = [65534, 65535, 65536, 70000, 131069, 131070, 131071, 140000, 196605]
+
+
+def long_string(length):
+    return bytearray((b"long string %d " % length * (length // 12 + 1))[:length])
+
+
+# Synthetic worlds written with DmbWriter, read back and written again must come out byte for byte the same.
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def round_trip(self, source):
+        source.write(self.path("a.dmb"))
+        dmb = Dmb(self.path("a.dmb"), check_string_crc=True)
+        dmb.write(self.path("b.dmb"))
+        with open(self.path("a.dmb"), "rb") as a, open(self.path("b.dmb"), "rb") as b:
+            self.assertEqual(a.read(), b.read())
+        return dmb
+
+    def test_worlds(self):
+        for bit32 in (False, True):
+            for min_client in (499, 507, 508, 510):
+                with self.subTest(bit32=bit32, min_client=min_client):
+                    source = synthetic_dmb(bit32=bit32, min_client=min_client, seed=min_client)
+                    dmb = self.round_trip(source)
+                    self.assertEqual(dmb.bit32, bit32)
+                    self.assertEqual(dmb.world.min_client, min_client)
+                    self.assertEqual([bytes(s) for s in dmb.strings], [bytes(s) for s in source.strings])
+                    self.assertEqual(dmb.data, [bytes(d) for d in source.data])
+                    ObjectTree(tree={}, dmb=Dmb(self.path("a.dmb"), string_mode=string_mode_strings))
+
+    def test_long_strings(self):
+        for bit32 in (False, True):
+            with self.subTest(bit32=bit32):
+                source = synthetic_dmb(bit32=bit32)
+                for length in long_string_lengths:
+                    source.strings.append(long_string(length))
+                dmb = self.round_trip(source)
+                self.assertEqual([len(s) for s in dmb.strings[-len(long_string_lengths):]], long_string_lengths)
+                self.assertEqual([bytes(s) for s in dmb.strings], [bytes(s) for s in source.strings])
+
+    @unittest.skipIf(columnar.np is None, "columnar mode requires numpy")
+    def test_columnar(self):
+        for bit32 in (False, True):
+            with self.subTest(bit32=bit32):
+                synthetic_dmb(bit32=bit32, instance_density=0.2).write(self.path("a.dmb"))
+                Dmb(self.path("a.dmb"), columnar=True).write(self.path("b.dmb"))
+                with open(self.path("a.dmb"), "rb") as a, open(self.path("b.dmb"), "rb") as b:
+                    self.assertEqual(a.read(), b.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb.stats import Stats
+
+
+# A phase recorded inside another counts only towards itself.
+class StatsTest(unittest.TestCase):
+    def test_nested_phases(self):
+        stats = Stats(profile_memory=True)
+        outer = stats.start()
+        kept = [bytearray(100000)]
+        inner = stats.start()
+        kept.append(bytearray(400000))
+        stats.record("inner", inner)
+        stats.record("outer", outer)
+        self.assertGreaterEqual(stats["inner"].retained, 400000)
+        self.assertLess(stats["outer"].retained, 200000)
+        self.assertGreaterEqual(stats["outer"].retained, 100000)
+
+    def test_abandoned_phase(self):
+        stats = Stats()
+        outer = stats.start()
+        stats.start()
+        stats.record("outer", outer)
+        self.assertEqual(stats._open, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dmb import Dmb, RawString, raw_string_mode_decrypted, raw_string_mode_string, string_mode_byte_strings, string_mode_lazy, string_mode_strings
+from dmb.dmb import control_codes, decode_control_codes, decode_strings, encode_control_codes, encode_strings
+from dmb.synthetic import synthetic_dmb
+
+
+# The control-code codec as RawString implemented it before the single-pass version: one replace per code.
+def replace_decode(data):
+    temp = bytearray(data)
+    for code, replacement in control_codes.items():
+        temp = temp.replace(code, replacement)
+    ccindex = temp.find(bytes([0xff]))
+    if ccindex != -1:
+        if len(temp) > ccindex + 1:
+            raise ValueError("Found unhandled control code: {0}".format(data[ccindex + 1]))
+        return "?"
+    return temp.decode('iso-8859-1')
+
+
+def replace_encode(string):
+    data = string.encode('iso-8859-1')
+    for code, replacement in control_codes.items():
+        data = data.replace(replacement, code)
+    return data
+
+
+codec_strings = [
+    b"",
+    b"plain text",
+    b"\\the backslash",
+    b"\xfe latin-1 \xe9",
+    b"The \xff\x01 sword",
+    b"\xff\x02\xff\x03",
+    b"\xff\x0a\xff\x0b\xff\x0c",
+    b"ends in an escape \xff",
+    b"\xff",
+] + list(control_codes) + [b"a" + code + b"b" + code for code in control_codes] + [a + b for a in control_codes for b in control_codes]
+
+
+# Every string mode must give the same strings, and the lazy table must behave like the list it stands in for.
+class StringModeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dmbname = os.path.join(self.directory, "world.dmb")
+        synthetic_dmb(seed=3).write(self.dmbname)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lazy_matches_strings(self):
+        strings = Dmb(self.dmbname, string_mode=string_mode_strings).strings
+        byte_strings = Dmb(self.dmbname, string_mode=string_mode_byte_strings).strings
+        lazy = Dmb(self.dmbname, string_mode=string_mode_lazy, check_string_crc=True).strings
+        self.assertEqual(len(lazy), len(strings))
+        self.assertEqual(list(lazy), list(strings))
+        self.assertEqual(list(lazy.iter_bytes()), [bytes(s) for s in byte_strings])
+        self.assertEqual(lazy[-1], strings[-1])
+        self.assertEqual(lazy[2:5], strings[2:5])
+
+    def test_lazy_index_out_of_range(self):
+        strings = Dmb(self.dmbname, string_mode=string_mode_strings).strings
+        lazy = Dmb(self.dmbname, string_mode=string_mode_lazy).strings
+        lazy[0]
+        lazy[len(lazy) - 1]
+        for index in (len(lazy), len(lazy) + 1, -len(lazy) - 1, -2 * len(lazy)):
+            with self.subTest(index=index):
+                with self.assertRaises(IndexError):
+                    strings[index]
+                with self.assertRaises(IndexError):
+                    lazy[index]
+
+    def test_lazy_cache_is_bounded(self):
+        lazy = Dmb(self.dmbname, string_mode=string_mode_lazy, string_cache_size=2).strings
+        first = lazy[0]
+        lazy[1]
+        self.assertIs(lazy[0], first)
+        lazy[2]
+        self.assertEqual(list(lazy._cache), [0, 2])
+        self.assertIsNot(lazy[1], None)
+        self.assertEqual(list(lazy._cache), [2, 1])
+        lazy.clear_cache()
+        self.assertEqual(len(lazy._cache), 0)
+        self.assertEqual(lazy[0], first)
+
+    def test_lazy_closed(self):
+        dmb = Dmb(self.dmbname, string_mode=string_mode_lazy)
+        lazy = dmb.strings
+        dmb.close()
+        with self.assertRaises(ValueError):
+            lazy[0]
+
+
+# The single-pass codec must agree with replacing one control code after another.
+class ControlCodeTest(unittest.TestCase):
+    def test_decode(self):
+        expected = [replace_decode(data) for data in codec_strings]
+        self.assertEqual(decode_strings(codec_strings), expected)
+        self.assertEqual([RawString(bytearray(data), 0, mode=raw_string_mode_decrypted).decode() for data in codec_strings], expected)
+        self.assertEqual([decode_control_codes(data) for data, string in zip(codec_strings, expected) if string != "?"], [string for string in expected if string != "?"])
+
+    def test_encode(self):
+        strings = [replace_decode(data) for data in codec_strings] + ["\\the", "\\thethe", "\\b\\i\\u\\s", "\\", "back\\slash\\"]
+        expected = [replace_encode(string) for string in strings]
+        self.assertEqual([encode_control_codes(string) for string in strings], expected)
+        self.assertEqual(encode_strings(strings), expected)
+        self.assertEqual([bytes(RawString(string, 0, mode=raw_string_mode_string).encode()) for string in strings], expected)
+
+    def test_unhandled_code(self):
+        for data in (b"\xff\x00", b"bad \xff\xfe code", b"\xff\xff"):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    replace_decode(data)
+                with self.assertRaises(ValueError):
+                    decode_control_codes(data)
+
+
+if __name__ == "__main__":
+    unittest.main()